@@ -2,17 +2,105 @@
 
 import os
 import json
-from langchain_openai import OpenAIEmbeddings
+import hashlib
 from langchain_community.vectorstores.faiss import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 import time
+import faiss
+import numpy as np
+
+from compact_docstore import export_vectorstore
+from embeddings_backend import check_fingerprint, fingerprint, make_embeddings, write_fingerprint
+from index_versions import new_version_dir, prune, publish, resolve_index_path
+from shard_index import district_of, shard_keys, write_shards
+from faiss_tuning import INDEX_TYPES, build_index, evaluate, search_params_of, write_report
+from opening_hours import encode, parse_weekday_text
+from place_cards import build_cards, collect_places, load_cards, make_llm, write_cards
 
-INDEX_PATH = "faiss_index"
 JSON_FILE  = "ramen_google_reviews.json"
 BATCH_SIZE = 50  # 1回で投げる件数
 
+# 保存するインデックスの種類（flat / hnsw / ivf / ivfpq / sq8）とパラメータ
+INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+INDEX_PARAMS = {
+    "hnsw_m": int(os.getenv("FAISS_HNSW_M", "32")),
+    "hnsw_ef_construction": int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200")),
+    "hnsw_ef_search": int(os.getenv("FAISS_HNSW_EF_SEARCH", "64")),
+    "ivf_nlist": int(os.getenv("FAISS_IVF_NLIST", "0")),  # 0 なら件数から自動
+    "ivf_nprobe": int(os.getenv("FAISS_IVF_NPROBE", "8")),
+    "pq_m": int(os.getenv("FAISS_PQ_M", "64")),
+    "pq_nbits": int(os.getenv("FAISS_PQ_NBITS", "8")),
+}
+# 近似インデックスでも追加・再構築できるよう、厳密なベクトルは別ファイルで持っておく
+FLAT_MASTER = "index.flat.faiss"
+# 地区ごと / geohash セルごとのシャードも書き出す（none / area / geohash）
+SHARD_BY = os.getenv("FAISS_SHARD_BY", "none").lower()
+SHARD_GEOHASH_PRECISION = int(os.getenv("FAISS_SHARD_GEOHASH_PRECISION", "5"))
+# 店舗カード（繁中 / 日 / 英の 地址・推薦・特色・營業時間）を作るか。前の版から変わった店だけ LLM で作る
+PLACE_CARDS_ENABLED = os.getenv("PLACE_CARDS_ENABLED", "1") == "1"
+REPORT_K = 10
+REPORT_QUERIES = 200
+
+def _owner(doc) -> str:
+    md = doc.metadata or {}
+    return md.get("place_id") or md.get("url") or md.get("title") or ""
+
+def chunk_key(doc) -> str:
+    """チャンクの同一判定（店 + 本文）。前の版に同じものがあれば埋め込み直さない"""
+    return hashlib.sha1(f"{_owner(doc)}\n{doc.page_content}".encode("utf-8")).hexdigest()
+
+def dedupe_against(vectorstore, chunks):
+    """前の版と同じチャンクは除き（metadata だけ最新にする）、入力に含まれる店の古くなったチャンクは消す。
+    毎回の取り込みで同じ店が重複して積み上がらないようにする"""
+    input_owners = {_owner(c) for c in chunks}
+    new_by_key = {chunk_key(c): c for c in chunks}
+    existing, stale = set(), []
+    for row in range(vectorstore.index.ntotal):
+        doc_id = vectorstore.index_to_docstore_id[row]
+        doc = vectorstore.docstore.search(doc_id)
+        key = chunk_key(doc)
+        existing.add(key)
+        if key in new_by_key:
+            doc.metadata = new_by_key[key].metadata  # 評価・営業時間・地区などは入力の方が新しい
+        elif _owner(doc) in input_owners:
+            stale.append(doc_id)
+    if stale:
+        vectorstore.delete(stale)
+        print(f"🧹 Removed {len(stale)} outdated chunks of re-crawled places.")
+    fresh = [c for c in chunks if chunk_key(c) not in existing]
+    print(f"✅ {len(chunks) - len(fresh)} chunks already indexed, {len(fresh)} to add.")
+    return fresh
+
+def convert_index(vectorstore, out_dir: str):
+    """flat のまま溜めたベクトルから INDEX_TYPE のインデックスを作り直し、レポートを出す"""
+    flat = vectorstore.index
+    faiss.write_index(flat, os.path.join(out_dir, FLAT_MASTER))
+
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    t0 = time.perf_counter()
+    index = build_index(vectors, INDEX_TYPE, flat.metric_type, **INDEX_PARAMS) if INDEX_TYPE != "flat" else flat
+    build_sec = time.perf_counter() - t0
+
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), size=min(REPORT_QUERIES, len(vectors)), replace=False)]
+    report = {
+        "index_type": INDEX_TYPE,
+        "ntotal": int(index.ntotal),
+        "dim": int(index.d),
+        "build_sec": round(build_sec, 2),
+        "search_params": search_params_of(index),
+        **evaluate(flat, index, sample, k=REPORT_K),
+    }
+    write_report(out_dir, report)
+    print(f"📊 {json.dumps(report, ensure_ascii=False)}")
+
+    vectorstore.index = index
+
 def main():
+    if INDEX_TYPE not in INDEX_TYPES:
+        raise RuntimeError(f"FAISS_INDEX_TYPE は {INDEX_TYPES} のいずれかにしてください")
+
     # 1) JSON 読み込み
     with open(JSON_FILE, "r", encoding="utf-8") as f:
         entries = json.load(f)
@@ -24,8 +112,24 @@ def main():
         metadata["title"] = e["title"]
         metadata["url"]   = e["url"]
         metadata["photo_url"] = metadata.get("photo_url", None)
+        # シャード分割（FAISS_SHARD_BY=area）用の地区。クローラは書かないので住所（なければ seed 名）から取る
+        area = e.get("area") or metadata.get("area") or district_of(metadata.get("address", "")) \
+            or district_of(metadata.get("seed", ""))
+        if area:
+            metadata["area"] = area
+        # 営業時間を 15 分刻みの週ビットマップ（hex）にしておく（検索時の「営業中」判定用）
+        metadata["open_slots"] = encode(
+            parse_weekday_text((metadata.get("opening_hours") or {}).get("weekday_text"))
+        )
         docs.append(Document(page_content=content, metadata=metadata))
 
+    if SHARD_BY == "area":
+        missing = sum(1 for d in docs if not d.metadata.get("area"))
+        if missing == len(docs):
+            raise RuntimeError("FAISS_SHARD_BY=area ですが、地区の取れた店が1件もありません（住所を確認してください）")
+        if missing:
+            print(f"⚠️ {missing}/{len(docs)} places have no area; they are sharded by geohash instead.")
+
     # 2) チャンクに分割
     splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
     chunks = splitter.split_documents(docs)
@@ -59,22 +163,37 @@ def main():
             Document(page_content=new_content, metadata=md)
         )
 
-    # 3) 埋め込みモデル
-    embedding = OpenAIEmbeddings()
+    # 入力内の重複も1つに
+    augmented_chunks = list({chunk_key(c): c for c in augmented_chunks}.values())
+
+    # 3) 埋め込みモデル（EMBEDDING_BACKEND / EMBEDDING_MODEL）
+    embedding = make_embeddings()
+    is_remote = fingerprint(embedding)["backend"] == "openai"
 
     # 4) インデックスのロード or 新規作成
-    if os.path.isdir(INDEX_PATH) and os.path.exists(os.path.join(INDEX_PATH, "index.faiss")):
+    #    今の版（なければ従来の faiss_index）を読み、結果は新しい版のディレクトリへ書く。
+    #    検索サーバは書き終わって CURRENT が切り替わるまで今の版を使い続ける
+    src_path, src_version = resolve_index_path()
+    out_path = new_version_dir()
+    if os.path.isdir(src_path) and os.path.exists(os.path.join(src_path, "index.faiss")):
         vectorstore = FAISS.load_local(
-            INDEX_PATH,
+            src_path,
             embedding,
             allow_dangerous_deserialization=True
         )
-        print(f"✅ Loaded existing index.")
+        # 別のモデルで作ったインデックスには追加しない
+        check_fingerprint(src_path, embedding, vectorstore.index.d)
+        # 近似インデックスで保存されていたら、厳密なベクトルの方に追加していく
+        master = os.path.join(src_path, FLAT_MASTER)
+        if os.path.exists(master):
+            vectorstore.index = faiss.read_index(master)
+        print(f"✅ Loaded existing index from '{src_path}'.")
+        # 前の版にあるチャンクは積まない（版ごとに全件が重複して増えていくのを防ぐ）
+        augmented_chunks = dedupe_against(vectorstore, augmented_chunks)
     else:
         # 最初のBATCHだけで新規作成
         first_batch = augmented_chunks[:BATCH_SIZE]
         vectorstore = FAISS.from_documents(first_batch, embedding)
-        os.makedirs(INDEX_PATH, exist_ok=True)
         print(f"✅ Created new index with {len(first_batch)} chunks.")
         augmented_chunks = augmented_chunks[BATCH_SIZE:]
 
@@ -83,10 +202,39 @@ def main():
         batch = augmented_chunks[i:i + BATCH_SIZE]
         vectorstore.add_documents(batch)
         print(f"✅ Added batch {i//BATCH_SIZE + 1} ({len(batch)} chunks)")
-        time.sleep(2)  # 2秒休憩してレート制限回避
-    # 6) 保存
-    vectorstore.save_local(INDEX_PATH)
-    print(f"✅ FAISS index saved at '{INDEX_PATH}'.")
+        if is_remote:
+            time.sleep(2)  # 2秒休憩してレート制限回避
+    # 6) インデックス種別の変換 & レポート → 保存
+    convert_index(vectorstore, out_path)
+    vectorstore.save_local(out_path)
+    write_fingerprint(out_path, fingerprint(embedding, dim=vectorstore.index.d))
+    print(f"✅ FAISS index saved at '{out_path}'.")
+    # 7) シャード（検索側は範囲内のシャードだけを並列に検索する）
+    if SHARD_BY != "none":
+        flat = faiss.read_index(os.path.join(out_path, FLAT_MASTER))
+        metadatas = [
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[row]).metadata
+            for row in range(flat.ntotal)
+        ]
+        keys = shard_keys(metadatas, by=SHARD_BY, precision=SHARD_GEOHASH_PRECISION)
+        manifest = write_shards(out_path, flat, metadatas, keys, INDEX_TYPE, **INDEX_PARAMS)
+        print(f"✅ {len(manifest['shards'])} shards saved ({SHARD_BY}).")
+    # 8) 検索サーバ用の compact docstore（pickle を読まずに mmap で開ける形式）
+    print(f"✅ Compact docstore saved at '{export_vectorstore(vectorstore, out_path)}'.")
+    # 9) 店舗カード（検索時は LLM に店を選ばせるだけにして、本文はカードから出す）
+    if PLACE_CARDS_ENABLED:
+        rows = (
+            (doc.page_content, doc.metadata)
+            for doc in (vectorstore.docstore.search(vectorstore.index_to_docstore_id[row])
+                        for row in range(vectorstore.index.ntotal))
+        )
+        cards = build_cards(collect_places(rows), make_llm(), previous=load_cards(src_path))
+        print(f"✅ {len(cards)} place cards saved at '{write_cards(out_path, cards)}'.")
+    # 10) 書き終わってから今の版を切り替える（検索サーバはこれを見て差し替える）
+    print(f"✅ Published version '{publish(out_path)}' (previous: {src_version or src_path}).")
+    removed = prune()
+    if removed:
+        print(f"🧹 Removed old versions: {', '.join(removed)}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,117 @@
+# answer_cache.py
+#
+# 意味的に近い質問に対して、前回の answer_ramen の結果をそのまま返すキャッシュ。
+# 「中山站附近的拉麵」と「中山站拉麵推薦」のような言い換えで LLM を呼ばずに済ませる。
+# - (言語, 位置セル, filter) ごとにバケットを分け、その中でコサイン類似度を比べる
+# - バケット内は正規化済みベクトルの行列なので、検索は行列積1回
+# - 空になったバケットは消し、バケット数も max_buckets で LRU に抑える（位置セル × 時間帯で増え続けるため）
+
+import copy
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+def location_cell(coord: Optional[tuple], cell_deg: float = 0.01) -> Optional[Tuple[int, int]]:
+    """座標をおよそ 1km 四方のセルに丸める（座標なしは None セル）"""
+    if not coord:
+        return None
+    lat, lng = coord
+    return (int(round(lat / cell_deg)), int(round(lng / cell_deg)))
+
+
+class _Bucket:
+    def __init__(self):
+        self.vectors: Optional[np.ndarray] = None   # (n, d) 正規化済み
+        self.expires = np.empty(0, dtype=np.float64)
+        self.results: List[Any] = []
+
+    def purge(self, now: float) -> None:
+        alive = self.expires > now
+        if alive.all():
+            return
+        idx = np.flatnonzero(alive)
+        self.vectors = self.vectors[idx] if len(idx) else None
+        self.expires = self.expires[idx]
+        self.results = [self.results[i] for i in idx]
+
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, ttl_sec: float = 6 * 3600, max_per_bucket: int = 256,
+                 max_buckets: int = 4096):
+        self.threshold = threshold
+        self.ttl_sec = ttl_sec
+        self.max_per_bucket = max_per_bucket
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[Hashable, _Bucket]" = OrderedDict()  # 末尾ほど最近使った
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def lookup(self, vec, bucket_key: Hashable) -> Optional[List[dict]]:
+        q = self._unit(vec)
+        now = time.time()
+        with self._lock:
+            b = self._buckets.get(bucket_key)
+            if b is not None:
+                b.purge(now)
+                if b.vectors is None:
+                    del self._buckets[bucket_key]
+                    b = None
+                else:
+                    self._buckets.move_to_end(bucket_key)
+            if b is None or b.vectors is None or b.vectors.shape[1] != q.shape[0]:
+                self.misses += 1
+                return None
+            sims = b.vectors @ q
+            i = int(np.argmax(sims))
+            if sims[i] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return copy.deepcopy(b.results[i])
+
+    def put(self, vec, bucket_key: Hashable, results: List[dict]) -> None:
+        q = self._unit(vec)[None, :]
+        now = time.time()
+        with self._lock:
+            b = self._buckets.setdefault(bucket_key, _Bucket())
+            self._buckets.move_to_end(bucket_key)
+            b.purge(now)
+            if b.vectors is not None and b.vectors.shape[1] != q.shape[1]:
+                b = self._buckets[bucket_key] = _Bucket()
+            b.vectors = q if b.vectors is None else np.vstack([b.vectors, q])
+            b.expires = np.append(b.expires, now + self.ttl_sec)
+            b.results.append(copy.deepcopy(results))
+            # 古いものから捨てる
+            overflow = len(b.results) - self.max_per_bucket
+            if overflow > 0:
+                b.vectors = b.vectors[overflow:]
+                b.expires = b.expires[overflow:]
+                b.results = b.results[overflow:]
+            # バケットが多すぎれば、最近使っていないものから丸ごと捨てる
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+
+    def clear(self) -> None:
+        """インデックスを差し替えたときなど、全部捨てる"""
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buckets": len(self._buckets),
+                "entries": sum(len(b.results) for b in self._buckets.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
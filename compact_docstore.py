@@ -0,0 +1,162 @@
+# compact_docstore.py
+#
+# pickle（InMemoryDocstore）の代わりに使う、読み取り専用の docstore。
+#   faiss_index/docstore/strings.heap   page_content・店名・metadata(JSON) を UTF-8 で連結したもの
+#   faiss_index/docstore/offsets.npy    (件数, フィールド数, 2) の [開始, 長さ]
+#   faiss_index/docstore/<列名>.npy     lat / lng / rating などの固定長の列
+# どれも mmap で開くだけなので起動はほぼ一瞬で、複数ワーカーでも OS のページキャッシュを共有できる。
+# 文字列は検索で当たった行だけ、その場でデコードする。
+#
+#   python compact_docstore.py [faiss_index]   既存の index.pkl から書き出す
+
+import os
+import sys
+import json
+import mmap
+from typing import Dict, Iterator, List, Union
+
+import numpy as np
+import faiss
+from langchain.schema import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores.faiss import FAISS
+
+from filter_engine import MetadataColumns
+
+COMPACT_DIR = "docstore"
+MANIFEST_FILE = "manifest.json"
+HEAP_FILE = "strings.heap"
+OFFSETS_FILE = "offsets.npy"
+
+STRING_FIELDS = ("id", "page_content", "title", "place_key", "mrt_stations", "bus_stations", "metadata")
+NUMERIC_COLUMNS = ("lat", "lng", "rating", "reviews_count", "price_level", "place_code")
+LIST_SEP = "\x1f"
+
+
+def compact_path(index_dir: str) -> str:
+    return os.path.join(index_dir, COMPACT_DIR)
+
+
+def exists(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(compact_path(index_dir), MANIFEST_FILE))
+
+
+class CompactDocstore(Docstore):
+    """行番号（文字列）で引く docstore。id は FAISS の行番号そのもの"""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.n = int(self.manifest["n"])
+        self._field = {name: i for i, name in enumerate(self.manifest["fields"])}
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self._columns = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in self.manifest["columns"]
+        }
+        self._file = open(os.path.join(path, HEAP_FILE), "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._heap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self) -> int:
+        return self.n
+
+    def text(self, row: int, field: str) -> str:
+        start, length = self._offsets[row, self._field[field]]
+        return self._heap[int(start): int(start) + int(length)].decode("utf-8")
+
+    def texts(self, field: str) -> Iterator[str]:
+        for row in range(self.n):
+            yield self.text(row, field)
+
+    def metadata(self, row: int) -> dict:
+        return json.loads(self.text(row, "metadata"))
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name]
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.text(row, "page_content"), metadata=self.metadata(row))
+
+    def search(self, search: str) -> Union[str, Document]:
+        try:
+            row = int(search)
+        except (TypeError, ValueError):
+            row = -1
+        if not 0 <= row < self.n:
+            return f"ID {search} not found."
+        return self.document(row)
+
+    def close(self) -> None:
+        if isinstance(self._heap, mmap.mmap):
+            self._heap.close()
+        self._file.close()
+
+
+def write_compact(index_dir: str, ids: List[str], docs: List[Document]) -> str:
+    """行番号順の (docstore id, Document) を compact 形式で書き出す"""
+    path = compact_path(index_dir)
+    os.makedirs(path, exist_ok=True)
+    metadatas = [d.metadata or {} for d in docs]
+    cols = MetadataColumns(metadatas)
+
+    offsets = np.zeros((len(docs), len(STRING_FIELDS), 2), dtype=np.int64)
+    pos = 0
+    with open(os.path.join(path, HEAP_FILE), "wb") as heap:
+        for row, (doc_id, doc, md) in enumerate(zip(ids, docs, metadatas)):
+            values = {
+                "id": str(doc_id),
+                "page_content": doc.page_content or "",
+                "title": md.get("title") or "",
+                "place_key": cols.place_keys[cols.place_code[row]],
+                "mrt_stations": LIST_SEP.join(md.get("mrt_stations") or []),
+                "bus_stations": LIST_SEP.join(md.get("bus_stations") or []),
+                "metadata": json.dumps(md, ensure_ascii=False, default=str),
+            }
+            for i, field in enumerate(STRING_FIELDS):
+                data = values[field].encode("utf-8")
+                heap.write(data)
+                offsets[row, i] = (pos, len(data))
+                pos += len(data)
+    np.save(os.path.join(path, OFFSETS_FILE), offsets)
+
+    columns = {name: getattr(cols, name) for name in NUMERIC_COLUMNS}
+    columns["open_slots"] = cols.hours.packed
+    columns["open_known"] = cols.hours.known
+    for name, arr in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(arr))
+
+    with open(os.path.join(path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(
+            {"n": len(docs), "fields": list(STRING_FIELDS), "columns": list(columns)},
+            f, ensure_ascii=False, indent=2,
+        )
+    return path
+
+
+def export_vectorstore(vectorstore: FAISS, index_dir: str) -> str:
+    """FAISS ベクトルストアの docstore を行番号順に書き出す"""
+    ids = [vectorstore.index_to_docstore_id[row] for row in range(vectorstore.index.ntotal)]
+    return write_compact(index_dir, ids, [vectorstore.docstore.search(i) for i in ids])
+
+
+def load_vectorstore(index_dir: str, embedding, index=None, io_flags: int = 0, **kwargs) -> FAISS:
+    """index.faiss + compact docstore から FAISS ベクトルストアを組み立てる（pickle を読まない）。
+    index を渡せば index.faiss は読まない（シャード分割したインデックスなど）"""
+    if index is None:
+        index = faiss.read_index(os.path.join(index_dir, "index.faiss"), io_flags)
+    docstore = CompactDocstore(compact_path(index_dir))
+    if docstore.n != index.ntotal:
+        raise RuntimeError(f"docstore の件数（{docstore.n}）と index の件数（{index.ntotal}）が一致しません")
+    index_to_docstore_id: Dict[int, str] = {row: str(row) for row in range(index.ntotal)}
+    return FAISS(embedding, index, docstore, index_to_docstore_id, **kwargs)
+
+
+if __name__ == "__main__":
+    from langchain_openai import OpenAIEmbeddings
+
+    from index_versions import resolve_index_path
+
+    index_dir = sys.argv[1] if len(sys.argv) > 1 else resolve_index_path()[0]
+    vs = FAISS.load_local(index_dir, OpenAIEmbeddings(), allow_dangerous_deserialization=True)
+    print(f"✅ compact docstore written to '{export_vectorstore(vs, index_dir)}' ({vs.index.ntotal} rows)")
@@ -0,0 +1,132 @@
+# embedding_cache.py
+#
+# クエリ埋め込みのキャッシュ（2段）
+#   1) プロセス内 LRU
+#   2) SQLite の永続ストア（再起動後もヒットする / 複数ワーカーで共有）
+# キーは「モデル名 + 正規化したクエリ文」
+
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_query(text: str) -> str:
+    """全角/半角・大小文字・空白の揺れを吸収する"""
+    s = unicodedata.normalize("NFKC", text or "")
+    s = re.sub(r"\s+", " ", s).strip().lower()
+    return s
+
+
+class CachedEmbeddings(Embeddings):
+    def __init__(
+        self,
+        underlying: Embeddings,
+        path: Optional[str] = "embedding_cache.sqlite3",
+        max_entries: int = 4096,
+        model_name: Optional[str] = None,
+    ):
+        self.underlying = underlying
+        self.model_name = model_name or getattr(underlying, "model", None) or type(underlying).__name__
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+
+        # SQLite の接続は最初に使うときに開く。fork 後の子プロセスでは開き直す
+        # （接続をプロセス間で共有すると壊れるため。serve.py の prefork 用）
+        self._path = path
+        self._db = None
+        self._db_pid = None
+
+    def _key(self, text: str) -> str:
+        raw = f"{self.model_name}\x00{normalize_query(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # ---------- 2段目（SQLite） ----------
+    def _conn(self) -> Optional[sqlite3.Connection]:
+        """呼び出し側で self._lock を取ってから呼ぶ"""
+        if not self._path:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[List[float]]:
+        if not self._path:
+            return None
+        with self._lock:
+            row = self._conn().execute("SELECT vec FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+        if not row:
+            return None
+        return array("f", row[0]).tolist()
+
+    def _disk_put(self, key: str, vec: List[float]) -> None:
+        if not self._path:
+            return
+        blob = array("f", vec).tobytes()
+        with self._lock:
+            self._conn().execute("INSERT OR REPLACE INTO query_embeddings (key, vec) VALUES (?, ?)", (key, blob))
+
+    # ---------- 1段目（LRU） ----------
+    def _memory_put(self, key: str, vec: List[float]) -> None:
+        with self._lock:
+            self._lru[key] = vec
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    # ---------- Embeddings インターフェース ----------
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+                self.hits_memory += 1
+                return vec
+
+        vec = self._disk_get(key)
+        if vec is not None:
+            with self._lock:
+                self.hits_disk += 1
+            self._memory_put(key, vec)
+            return vec
+
+        vec = self.underlying.embed_query(text)
+        with self._lock:
+            self.misses += 1
+        self._memory_put(key, vec)
+        self._disk_put(key, vec)
+        return vec
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # 文書側はインデックス作成時にしか呼ばれないのでキャッシュしない
+        return self.underlying.embed_documents(texts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "model": self.model_name,
+                "entries_memory": len(self._lru),
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "hit_rate": (self.hits_memory + self.hits_disk) / total if total else 0.0,
+            }
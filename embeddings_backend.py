@@ -0,0 +1,177 @@
+# embeddings_backend.py
+#
+# 埋め込みモデルの切り替え（EMBEDDING_BACKEND）:
+#   openai  OpenAIEmbeddings（既定。これまでのインデックスはすべてこれで作られている）
+#   local   sentence-transformers の多言語モデルを CPU で実行（ネットワーク往復なし）
+#           EMBEDDING_QUANTIZE=int8 で Linear 層を動的量子化、onnx で ONNX Runtime 実行
+#           （onnx は optimum[onnxruntime] が必要）
+# 同時に来たクエリはまとめて1回の encode にする（動的バッチ）。
+#
+# インデックスと検索側でモデルが違うと、ベクトル空間が違うのに黙って検索できてしまうので、
+# 作成時のモデルを faiss_index/embedding.json に記録し、読み込み時に照合する。
+
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "")
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "none").lower()  # none | int8 | onnx
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+DEFAULT_MODELS = {
+    "openai": "text-embedding-ada-002",
+    "local": "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+}
+FINGERPRINT_FILE = "embedding.json"
+
+
+class _MicroBatcher:
+    """同時に来た embed_query を最大 max_wait_ms 待ってまとめ、1回の encode にする"""
+
+    def __init__(self, encode: Callable[[List[str]], List[List[float]]], max_batch: int, max_wait_ms: float):
+        self._encode = encode
+        self._max_batch = max(1, max_batch)
+        self._max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self) -> "queue.Queue":
+        """fork した子ではスレッドが引き継がれないので、pid が変わっていたらキューごと作り直す"""
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(
+                        target=self._run, args=(self._queue,), name="embed-batcher", daemon=True
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def submit(self, text: str) -> List[float]:
+        q = self._ensure_thread()
+        fut: Future = Future()
+        q.put((text, fut))
+        return fut.result()
+
+    def _run(self, q: "queue.Queue") -> None:
+        while True:
+            items = [q.get()]
+            deadline = time.monotonic() + self._max_wait
+            while len(items) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vecs = self._encode([text for text, _ in items])
+                for (_, fut), vec in zip(items, vecs):
+                    fut.set_result(vec)
+            except Exception as e:
+                for _, fut in items:
+                    fut.set_exception(e)
+
+
+class LocalEmbeddings(Embeddings):
+    """sentence-transformers の CPU 推論（正規化済みベクトルを返す）"""
+
+    def __init__(self, model_name: str, quantize: str = "none",
+                 batch_size: int = EMBEDDING_BATCH_SIZE, batch_wait_ms: float = EMBEDDING_BATCH_WAIT_MS):
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.quantize = quantize
+        self.batch_size = batch_size
+        if quantize == "onnx":
+            self._model = SentenceTransformer(model_name, device="cpu", backend="onnx")
+        else:
+            self._model = SentenceTransformer(model_name, device="cpu")
+            if quantize == "int8":
+                import torch
+
+                self._model = torch.quantization.quantize_dynamic(
+                    self._model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+        self.dim = int(self._model.get_sentence_embedding_dimension())
+        self._batcher = _MicroBatcher(self._encode, batch_size, batch_wait_ms)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        vecs = self._model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False,
+        )
+        return vecs.astype("float32").tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._batcher.submit(text)
+
+
+def make_embeddings(backend: Optional[str] = None, model: Optional[str] = None) -> Embeddings:
+    """環境変数（または引数）に従って埋め込みモデルを作る"""
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    if backend not in DEFAULT_MODELS:
+        raise ValueError(f"unknown EMBEDDING_BACKEND: {backend} (choose from {tuple(DEFAULT_MODELS)})")
+    model = model or EMBEDDING_MODEL or DEFAULT_MODELS[backend]
+    if backend == "local":
+        return LocalEmbeddings(model, quantize=EMBEDDING_QUANTIZE)
+    from langchain_openai import OpenAIEmbeddings
+
+    return OpenAIEmbeddings(model=model)
+
+
+def fingerprint(embedding: Embeddings, dim: Optional[int] = None) -> dict:
+    """ベクトル空間を決めるもの（backend / model / 次元）"""
+    if isinstance(embedding, LocalEmbeddings):
+        return {"backend": "local", "model": embedding.model_name,
+                "dim": dim or embedding.dim, "quantize": embedding.quantize}
+    return {"backend": "openai", "model": getattr(embedding, "model", DEFAULT_MODELS["openai"]), "dim": dim}
+
+
+def fingerprint_id(fp: dict) -> str:
+    """埋め込みキャッシュのキーなどに使う短い名前"""
+    return f"{fp['backend']}:{fp['model']}"
+
+
+def write_fingerprint(index_dir: str, fp: dict) -> None:
+    with open(os.path.join(index_dir, FINGERPRINT_FILE), "w", encoding="utf-8") as f:
+        json.dump(fp, f, ensure_ascii=False, indent=2)
+
+
+def read_fingerprint(index_dir: str) -> dict:
+    """記録がなければ、これまでの既定（OpenAI）で作られたものとみなす"""
+    try:
+        with open(os.path.join(index_dir, FINGERPRINT_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"backend": "openai", "model": DEFAULT_MODELS["openai"], "dim": None}
+
+
+def check_fingerprint(index_dir: str, embedding: Embeddings, index_dim: Optional[int] = None) -> dict:
+    """インデックスを作ったモデルと embedding が同じベクトル空間か確かめる。違えば RuntimeError"""
+    saved = read_fingerprint(index_dir)
+    current = fingerprint(embedding)
+    if fingerprint_id(saved) != fingerprint_id(current):
+        raise RuntimeError(
+            f"埋め込みモデルがインデックスと一致しません: index={fingerprint_id(saved)} "
+            f"current={fingerprint_id(current)}（EMBEDDING_BACKEND / EMBEDDING_MODEL を確認してください）"
+        )
+    dims = {d for d in (saved.get("dim"), current.get("dim"), index_dim) if d}
+    if len(dims) > 1:
+        raise RuntimeError(f"埋め込みの次元がインデックスと一致しません: {sorted(dims)}")
+    return saved
@@ -0,0 +1,141 @@
+# faiss_tuning.py
+#
+# FAISS インデックスの種類（flat / hnsw / ivf / ivfpq / sq8）の作成と、
+# 検索パラメータの適用、厳密検索（flat）との比較レポート。
+#   作成側: add_reviews_to_faiss.py
+#   読込側: ramen_qa.py（build_report.json の search_params を適用）
+
+import os
+import json
+import math
+import time
+from typing import Optional
+
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "hnsw", "ivf", "ivfpq", "sq8")
+REPORT_FILE = "build_report.json"
+
+
+def _default_nlist(n: int) -> int:
+    # 学習データは 1 セルあたり 39 点以上ないと FAISS が警告する
+    return max(1, min(int(4 * math.sqrt(max(n, 1))), n // 39 or 1))
+
+
+def factory_string(index_type: str, d: int, n: int, params: dict) -> str:
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{params.get('hnsw_m', 32)},Flat"
+    nlist = params.get("ivf_nlist") or _default_nlist(n)
+    nlist = max(1, min(nlist, n // 39 or 1))
+    if index_type == "ivf":
+        return f"IVF{nlist},Flat"
+    if index_type == "sq8":
+        return f"IVF{nlist},SQ8"
+    if index_type == "ivfpq":
+        m = params.get("pq_m", 64)
+        while d % m:
+            m -= 1
+        # PQ の学習には 2^nbits 点以上必要
+        nbits = min(params.get("pq_nbits", 8), max(1, int(math.log2(max(n, 2)))))
+        return f"IVF{nlist},PQ{m}x{nbits}"
+    raise ValueError(f"unknown index type: {index_type} (choose from {INDEX_TYPES})")
+
+
+def build_index(vectors: np.ndarray, index_type: str, metric: int = faiss.METRIC_L2, **params):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, d = vectors.shape
+    index = faiss.index_factory(d, factory_string(index_type, d, n, params), metric)
+    if index_type == "hnsw":
+        index.hnsw.efConstruction = params.get("hnsw_ef_construction", 200)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    if index_type in ("ivf", "ivfpq", "sq8"):
+        # reconstruct（ramen_qa の候補の並べ替え）に必要
+        faiss.extract_index_ivf(index).make_direct_map()
+    apply_search_params(index, params.get("hnsw_ef_search"), params.get("ivf_nprobe"))
+    return index
+
+
+def apply_search_params(index, ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> None:
+    if ef_search and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = int(ef_search)
+    if nprobe:
+        try:
+            faiss.extract_index_ivf(index).nprobe = int(nprobe)
+        except Exception:
+            pass  # IVF 以外
+
+
+def search_with_mask(index, queries: np.ndarray, k: int, mask: np.ndarray):
+    """mask が True の行だけを対象に検索する（IDSelector でスコア計算前に絞る）"""
+    sel = faiss.IDSelectorBitmap(np.packbits(mask, bitorder="little"))
+    if hasattr(index, "hnsw"):
+        params = faiss.SearchParametersHNSW(sel=sel, efSearch=index.hnsw.efSearch)
+    else:
+        try:
+            params = faiss.SearchParametersIVF(sel=sel, nprobe=faiss.extract_index_ivf(index).nprobe)
+        except Exception:
+            params = faiss.SearchParameters(sel=sel)
+    return index.search(np.ascontiguousarray(queries, dtype=np.float32), k, params=params)
+
+
+def search_params_of(index) -> dict:
+    out = {}
+    if hasattr(index, "hnsw"):
+        out["hnsw_ef_search"] = int(index.hnsw.efSearch)
+    try:
+        out["ivf_nprobe"] = int(faiss.extract_index_ivf(index).nprobe)
+    except Exception:
+        pass
+    return out
+
+
+def evaluate(exact_index, index, queries: np.ndarray, k: int = 10) -> dict:
+    """厳密検索に対する recall@k、1クエリずつの p50/p99 レイテンシ、1ベクトルあたりのバイト数"""
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    k = min(k, index.ntotal)
+    _, truth = exact_index.search(queries, k)
+
+    found, latencies = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, ids = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found.append(ids[0])
+    recall = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+    return {
+        "k": k,
+        "queries": len(queries),
+        f"recall@{k}": round(recall, 4),
+        "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+        "latency_ms_p99": round(float(np.percentile(latencies, 99)), 3),
+        "bytes_per_vector": round(len(faiss.serialize_index(index)) / max(index.ntotal, 1), 1),
+    }
+
+
+def read_flags(use_mmap: bool) -> int:
+    """read_index のフラグ。use_mmap ならファイルを mmap で開き、複数プロセスでページを共有する"""
+    if not use_mmap:
+        return 0
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        # flat のベクトル本体もコピーせずに参照する（faiss 1.10 以降）
+        return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+    return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+
+
+def write_report(index_dir: str, report: dict) -> None:
+    with open(os.path.join(index_dir, REPORT_FILE), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def read_report(index_dir: str) -> dict:
+    try:
+        with open(os.path.join(index_dir, REPORT_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
@@ -0,0 +1,178 @@
+# filter_engine.py
+#
+# docstore の metadata を列ごとの NumPy 配列にしたものと、その上で評価する filter。
+# filter は「行番号 → 残すかどうか」の bool マスクにコンパイルし、
+# ベクトル検索の前に候補を絞る（後から絞って件数が足りなくなる問題を避ける）。
+#
+# filter の書き方（複数キーは AND）:
+#   {"rating": {"gte": 4.0}}                       範囲: gt / gte / lt / lte / eq
+#   {"reviews_count": {"gte": 100}}
+#   {"price_level": {"lte": 2}}                    1:～200 2:200～400 3:400～800 4:800以上
+#   {"price_range": ["NT$～200", "NT$200～400"]}   crawler が入れる文字列でも可
+#   {"mrt_stations": ["中山", "雙連站"]}            部分一致、どれか1つ
+#   {"bus_stations": {"in": ["公館"]}}
+#   {"location": {"lat": 25.05, "lng": 121.52, "radius_m": 1000}}
+#   {"open_at": "now"}                             営業中（ISO 日時文字列 / datetime も可）
+#   {"open_at": {"at": "now", "include_unknown": true}}  営業時間不明の店も残す
+
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from geo_index import haversine_m
+from opening_hours import OpenHoursIndex, now_taipei
+
+PRICE_LEVELS = {"NT$～200": 1, "NT$200～400": 2, "NT$400～800": 3, "NT$800以上": 4}
+
+_RANGE_OPS = {
+    "gt": np.greater, "gte": np.greater_equal,
+    "lt": np.less, "lte": np.less_equal, "eq": np.equal,
+}
+
+
+def _station_key(name: str) -> str:
+    """「捷運中山站」「中山站」「中山」を同じものとして扱う"""
+    s = re.sub(r"\s+", "", name or "")
+    s = re.sub(r"^(捷運|台北捷運|MRT)", "", s, flags=re.IGNORECASE)
+    return re.sub(r"(站|駅|station)$", "", s, flags=re.IGNORECASE)
+
+
+class _StationColumn:
+    """行ごとの駅名リストを「駅 → 行番号配列」で持つ"""
+
+    def __init__(self, lists: List[List[str]]):
+        rows_by_station: Dict[str, list] = {}
+        for row, names in enumerate(lists):
+            for name in names or []:
+                rows_by_station.setdefault(_station_key(name), []).append(row)
+        self._rows = {k: np.asarray(v, dtype=np.int64) for k, v in rows_by_station.items()}
+
+    def rows_matching(self, names: Iterable[str]) -> np.ndarray:
+        keys = [_station_key(n) for n in names if n]
+        parts = [rows for st, rows in self._rows.items() if any(k and k in st for k in keys)]
+        return np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+
+class MetadataColumns:
+    def __init__(self, metadatas: List[dict]):
+        n = len(metadatas)
+        self.n = n
+        self.lat = np.full(n, np.nan)
+        self.lng = np.full(n, np.nan)
+        self.rating = np.full(n, np.nan, dtype=np.float32)
+        self.reviews_count = np.full(n, -1, dtype=np.int32)
+        self.price_level = np.zeros(n, dtype=np.int8)  # 0 = 不明
+        # 店舗 id（place_id、なければ店名）を整数に振り直したもの。チャンク → 店舗の集約用
+        self.place_code = np.zeros(n, dtype=np.int32)
+        self.place_keys: List[str] = []
+        codes: Dict[str, int] = {}
+        mrt, bus = [], []
+
+        for row, md in enumerate(metadatas):
+            md = md or {}
+            loc = md.get("location") or {}
+            if loc.get("lat") is not None and loc.get("lng") is not None:
+                self.lat[row], self.lng[row] = float(loc["lat"]), float(loc["lng"])
+            if isinstance(md.get("rating"), (int, float)):
+                self.rating[row] = md["rating"]
+            if isinstance(md.get("reviews_count"), int):
+                self.reviews_count[row] = md["reviews_count"]
+            self.price_level[row] = PRICE_LEVELS.get(md.get("price_range"), 0)
+            key = md.get("place_id") or md.get("title") or f"#{row}"
+            if key not in codes:
+                codes[key] = len(self.place_keys)
+                self.place_keys.append(key)
+            self.place_code[row] = codes[key]
+            mrt.append(md.get("mrt_stations") or [])
+            bus.append(md.get("bus_stations") or [])
+
+        self.mrt_stations = _StationColumn(mrt)
+        self.bus_stations = _StationColumn(bus)
+        self.hours = OpenHoursIndex.from_metadatas(metadatas)
+        self._place_index = codes
+
+    @classmethod
+    def from_compact(cls, store) -> "MetadataColumns":
+        """compact_docstore の列（mmap）から作る。metadata の JSON は読まない"""
+        self = cls.__new__(cls)
+        self.n = len(store)
+        for name in ("lat", "lng", "rating", "reviews_count", "price_level", "place_code"):
+            setattr(self, name, store.column(name))
+        self._place_index = {}
+        for row, key in enumerate(store.texts("place_key")):
+            self._place_index.setdefault(key, int(self.place_code[row]))
+        self.place_keys = sorted(self._place_index, key=self._place_index.get)
+        self.mrt_stations = _StationColumn([s.split("\x1f") if s else [] for s in store.texts("mrt_stations")])
+        self.bus_stations = _StationColumn([s.split("\x1f") if s else [] for s in store.texts("bus_stations")])
+        self.hours = OpenHoursIndex(store.column("open_slots"), store.column("open_known"))
+        return self
+
+    def place_code_of(self, md: dict) -> Optional[int]:
+        """metadata から店舗番号を引く（見つからなければ None）"""
+        return self._place_index.get((md or {}).get("place_id") or (md or {}).get("title"))
+
+    def __len__(self) -> int:
+        return self.n
+
+
+def _as_list(val) -> list:
+    if isinstance(val, dict):
+        val = val.get("in", [])
+    return list(val) if isinstance(val, (list, tuple, set)) else [val]
+
+
+def _range_mask(col: np.ndarray, spec: Any) -> np.ndarray:
+    if not isinstance(spec, dict):
+        spec = {"eq": spec}
+    if "in" in spec:
+        return np.isin(col, spec["in"])
+    mask = np.ones(len(col), dtype=bool)
+    for op, val in spec.items():
+        if op not in _RANGE_OPS:
+            raise ValueError(f"unsupported range operator: {op}")
+        mask &= _RANGE_OPS[op](col, val)  # NaN は常に False
+    return mask
+
+
+def resolve_time(at: Any) -> datetime:
+    if at in (None, "now"):
+        return now_taipei()
+    if isinstance(at, datetime):
+        return at
+    return datetime.fromisoformat(str(at))
+
+
+def is_time_dependent(spec: Optional[Dict[str, Any]]) -> bool:
+    """"now" を含む filter はリクエストごとに評価し直す必要がある"""
+    return bool(spec) and "open_at" in spec
+
+
+def build_mask(spec: Optional[Dict[str, Any]], cols: MetadataColumns) -> Optional[np.ndarray]:
+    """filter を bool マスクにする。filter がなければ None（全件）"""
+    if not spec:
+        return None
+    mask = np.ones(len(cols), dtype=bool)
+    for key, val in spec.items():
+        if key in ("rating", "reviews_count", "price_level"):
+            mask &= _range_mask(getattr(cols, key), val)
+        elif key == "price_range":
+            levels = [PRICE_LEVELS.get(v, -1) for v in _as_list(val)]
+            mask &= np.isin(cols.price_level, levels)
+        elif key in ("mrt_stations", "bus_stations"):
+            hit = np.zeros(len(cols), dtype=bool)
+            hit[getattr(cols, key).rows_matching(_as_list(val))] = True
+            mask &= hit
+        elif key == "location":
+            radius = val.get("radius_m")
+            if radius is None:
+                continue  # 半径なしは絞り込みではなく距離順の基準（呼び出し側で扱う）
+            d = haversine_m(val["lat"], val["lng"], cols.lat, cols.lng)
+            mask &= d <= radius  # 座標なし（NaN）は落ちる
+        elif key == "open_at":
+            opt = val if isinstance(val, dict) else {"at": val}
+            mask &= cols.hours.open_at(resolve_time(opt.get("at")), bool(opt.get("include_unknown")))
+        else:
+            raise ValueError(f"unsupported filter key: {key}")
+    return mask
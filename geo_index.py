@@ -0,0 +1,86 @@
+# geo_index.py
+#
+# FAISS の行番号ごとの緯度経度を NumPy 配列で持ち、
+# 格子（約 1km 四方）で半径検索、距離はベクトル化した haversine で求める。
+# 検索結果の上位10件だけでなく、コーパス全体から近い店を拾えるようにするためのもの。
+
+import math
+from typing import Dict, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = 111320.0
+
+
+def haversine_m(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """1点と多数点の距離（m）。入力は度"""
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2, lng2 = np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class GeoIndex:
+    def __init__(self, lats, lngs, cell_deg: float = 0.01):
+        self.lat = np.asarray(lats, dtype=np.float64)
+        self.lng = np.asarray(lngs, dtype=np.float64)
+        self.cell_deg = cell_deg
+
+        # 格子セル → 行番号の配列
+        valid = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lng)))
+        ci = np.floor(self.lat[valid] / cell_deg).astype(np.int64)
+        cj = np.floor(self.lng[valid] / cell_deg).astype(np.int64)
+        order = np.lexsort((cj, ci))
+        ci, cj, rows = ci[order], cj[order], valid[order]
+        self._cells: Dict[Tuple[int, int], np.ndarray] = {}
+        if len(rows):
+            change = np.flatnonzero((np.diff(ci) != 0) | (np.diff(cj) != 0)) + 1
+            starts = np.concatenate([[0], change])
+            ends = np.concatenate([change, [len(rows)]])
+            for s, e in zip(starts, ends):
+                self._cells[(int(ci[s]), int(cj[s]))] = rows[s:e]
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    @classmethod
+    def from_metadatas(cls, metadatas, cell_deg: float = 0.01) -> "GeoIndex":
+        """行番号順の metadata（location: {lat, lng}）から作る"""
+        lats, lngs = [], []
+        for md in metadatas:
+            loc = (md or {}).get("location") or {}
+            lat, lng = loc.get("lat"), loc.get("lng")
+            lats.append(float(lat) if lat is not None else np.nan)
+            lngs.append(float(lng) if lng is not None else np.nan)
+        return cls(lats, lngs, cell_deg=cell_deg)
+
+    def distances(self, lat: float, lng: float, rows=None) -> np.ndarray:
+        """行ごとの距離（m）。座標のない行は inf"""
+        lats = self.lat if rows is None else self.lat[rows]
+        lngs = self.lng if rows is None else self.lng[rows]
+        d = haversine_m(lat, lng, lats, lngs)
+        return np.where(np.isnan(d), np.inf, d)
+
+    def within(self, lat: float, lng: float, radius_m: float):
+        """半径内の (行番号, 距離) を近い順に返す"""
+        di = int(math.ceil(radius_m / (METERS_PER_DEG_LAT * self.cell_deg)))
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        dj = int(math.ceil(radius_m / (METERS_PER_DEG_LAT * cos_lat * self.cell_deg)))
+        i0 = int(math.floor(lat / self.cell_deg))
+        j0 = int(math.floor(lng / self.cell_deg))
+
+        parts = [
+            self._cells[(i, j)]
+            for i in range(i0 - di, i0 + di + 1)
+            for j in range(j0 - dj, j0 + dj + 1)
+            if (i, j) in self._cells
+        ]
+        if not parts:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        rows = np.concatenate(parts)
+        d = self.distances(lat, lng, rows)
+        keep = d <= radius_m
+        rows, d = rows[keep], d[keep]
+        order = np.argsort(d, kind="stable")
+        return rows[order], d[order]
@@ -1,9 +1,78 @@
 # geo_utils.py
 
+import os
+import re
+import json
+import threading
+
 import requests
-from langchain_openai import ChatOpenAI
 
-llm = ChatOpenAI(model="gpt-3.5-turbo")
+# Geocoding API が詰まっても返信（LINE の応答）を止めないように
+GEOCODE_TIMEOUT_SEC = float(os.getenv("GEOCODE_TIMEOUT_SEC", "5"))
+
+# LLM は最初に使うときに1回だけ作る（import を軽くするため）
+_llm = None
+_llm_lock = threading.Lock()
+
+def _get_llm():
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                from langchain_openai import ChatOpenAI
+                _llm = ChatOpenAI(model="gpt-3.5-turbo")
+    return _llm
+
+def warmup() -> None:
+    _get_llm()
+
+def geocode(place: str, api_key: str):
+    """地名 → (lat, lng)。取れなければ (None, None)"""
+    resp = requests.get(
+        "https://maps.googleapis.com/maps/api/geocode/json",
+        params={"address": f"台北 {place}", "key": api_key},
+        timeout=GEOCODE_TIMEOUT_SEC,
+    )
+    if resp.status_code != 200:
+        print(f"[ERROR] 座標変換失敗: HTTP {resp.status_code} ({place})")
+        return None, None
+    results = resp.json().get("results", [])
+    if results:
+        loc = results[0]["geometry"]["location"]
+        return loc["lat"], loc["lng"]
+    return None, None
+
+def analyze_query(text: str, translate: bool = True) -> dict:
+    """地名の抽出・検索用の中国語訳・絞り込み条件の抽出を1回の LLM 呼び出しでまとめて行う
+    → {"place": 地名 or None, "zh_query": 中国語の質問（translate=False なら原文）, "conditions": dict}"""
+    task = "- 将质问翻译成简体中文（zh_query）。\n" if translate else ""
+    prompt = f"""请分析以下质问：
+- 只抽出质问中提到的一个台湾地名或地址（place），例如「中山」「信義區」「西門町」「永康街」，町名・车站名・景点都可以。没有的话为空字符串。
+{task}- 只抽出质问中明确提到的条件（conditions），没有提到的保持 null / 空字符串 / false：
+  min_rating：最低评分（1～5，例如「4星以上」→ 4）
+  min_reviews：最少评论数
+  max_price_level：价格上限（1：NT$200以下 2：NT$200～400 3：NT$400～800 4：NT$800以上，例如「便宜」→ 1）
+  mrt_station：明确要求在某个捷运站附近时的站名
+  radius_m：明确提到距离时的半径（公尺，例如「走路5分钟」→ 400）
+  open_now：问现在营业中的店时为 true
+
+请只输出 JSON，不要加入其他文字：
+{{"place": "", "zh_query": "", "conditions": {{"min_rating": null, "min_reviews": null, "max_price_level": null, "mrt_station": "", "radius_m": null, "open_now": false}}}}
+
+质问：
+{text}
+"""
+    out = {}
+    try:
+        raw = _get_llm().predict(prompt)
+        match = re.search(r"\{.*\}", raw, re.S)
+        out = json.loads(match.group(0)) if match else {}
+    except Exception as e:
+        print(f"[ERROR] 質問の解析失敗: {e}")
+    place = str(out.get("place") or "").strip()
+    zh_query = str(out.get("zh_query") or "").strip() if translate else ""
+    conditions = out.get("conditions") if isinstance(out.get("conditions"), dict) else {}
+    return {"place": place or None, "zh_query": zh_query or text, "conditions": conditions}
 
 def extract_location_from_text(text: str, api_key: str):
     try:
@@ -17,23 +86,14 @@ def extract_location_from_text(text: str, api_key: str):
 
 出力（地名のみ）：
 """
-        place = llm.predict(prompt).strip()
+        place = _get_llm().predict(prompt).strip()
 
         if not place:
             return None, None
 
         # ジオコード変換
-        resp = requests.get(
-            "https://maps.googleapis.com/maps/api/geocode/json",
-            params={"address": f"台北 {place}", "key": api_key}
-        )
-        results = resp.json().get("results", [])
-        if results:
-            loc = results[0]["geometry"]["location"]
-            return loc["lat"], loc["lng"]
+        return geocode(place, api_key)
 
     except Exception as e:
         print(f"[ERROR] 地名抽出/座標変換失敗: {e}")
         return None, None
-
-    return None, None
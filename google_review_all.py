@@ -212,6 +212,7 @@ for area_name, center in SEED_LOCATIONS:
                 "price_range": price_range,
                 "photo_url": photo_url,
                 "photo_reference": photo_ref,  # ← プロキシ運用するなら使う
+                "seed": area_name,  # どの seed で見つけたか（住所から地区が取れないときの地区の手がかり）
             }
 
             entry = {
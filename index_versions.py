@@ -0,0 +1,73 @@
+# index_versions.py
+#
+# インデックスを版ごとのディレクトリに作り、CURRENT ファイルで今の版を指す。
+#   faiss_index_versions/20250101-120000/   add_reviews_to_faiss.py が1回ごとに新しく作る
+#   faiss_index_versions/CURRENT            今の版の名前（書き終わってから一時ファイル + os.replace で差し替え）
+# 検索サーバは CURRENT が変わったら新しい版を横で読み込み、読み終わってから参照を差し替える。
+# 書きかけの版が読まれることはない。CURRENT がなければ従来の faiss_index をそのまま使う。
+
+import os
+import time
+import shutil
+from typing import Optional, Tuple
+
+INDEX_ROOT = os.getenv("FAISS_INDEX_ROOT", "faiss_index_versions")
+LEGACY_INDEX_PATH = "faiss_index"
+CURRENT_FILE = "CURRENT"
+KEEP_VERSIONS = int(os.getenv("FAISS_INDEX_KEEP_VERSIONS", "3"))
+
+
+def current_version(root: str = INDEX_ROOT) -> Optional[str]:
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return name if name and os.path.isdir(os.path.join(root, name)) else None
+
+
+def resolve_index_path(root: str = INDEX_ROOT) -> Tuple[str, Optional[str]]:
+    """(読み込むディレクトリ, 版の名前)。版がなければ従来の faiss_index（版は None）"""
+    version = current_version(root)
+    if version is None:
+        return LEGACY_INDEX_PATH, None
+    return os.path.join(root, version), version
+
+
+def new_version_dir(root: str = INDEX_ROOT) -> str:
+    """書き込み用の新しい版のディレクトリ（まだ CURRENT からは指さない）"""
+    os.makedirs(root, exist_ok=True)
+    base = time.strftime("%Y%m%d-%H%M%S")
+    name, i = base, 1
+    while os.path.exists(os.path.join(root, name)):
+        name, i = f"{base}-{i}", i + 1
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    return path
+
+
+def publish(path: str) -> str:
+    """path の版を CURRENT にする（原子的に差し替え）"""
+    root, name = os.path.split(os.path.normpath(path))
+    tmp = os.path.join(root, f".{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(root, CURRENT_FILE))
+    return name
+
+
+def prune(root: str = INDEX_ROOT, keep: int = KEEP_VERSIONS) -> list:
+    """古い版を消す（CURRENT と新しい順に keep 個は残す。読み込み中のサーバのため余裕を持たせる）"""
+    current = current_version(root)
+    versions = sorted(
+        (d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d))), reverse=True
+    ) if os.path.isdir(root) else []
+    removed = []
+    for name in versions[max(keep, 1):]:
+        if name == current:
+            continue
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        removed.append(name)
+    return removed
@@ -1,20 +1,28 @@
 # inspect_faiss.py
 
-from langchain_community.embeddings import SentenceTransformerEmbeddings
 from langchain_community.vectorstores.faiss import FAISS
 
-# 1. 埋め込みモデル初期化
-embedding = SentenceTransformerEmbeddings(model_name="all-MiniLM-L6-v2")
+from embeddings_backend import check_fingerprint, make_embeddings, read_fingerprint
+from index_versions import resolve_index_path
+
+# 今の版（faiss_index_versions/CURRENT、なければ faiss_index）
+INDEX_DIR, INDEX_VERSION = resolve_index_path()
+
+# 1. 埋め込みモデル初期化（インデックス作成時と同じ EMBEDDING_BACKEND / EMBEDDING_MODEL）
+embedding = make_embeddings()
 
 # 2. インデックス読み込み（自分が作成したインデックスなので安全とみなし許可）
 vectorstore = FAISS.load_local(
-    "faiss_index", 
+    INDEX_DIR, 
     embedding, 
     allow_dangerous_deserialization=True
 )
 
-# 3. 登録ベクトル数を表示
+# 3. 登録ベクトル数と、作成に使った埋め込みモデルを表示
+print("Index:", INDEX_DIR, f"(version {INDEX_VERSION})" if INDEX_VERSION else "")
 print("Total vectors:", vectorstore.index.ntotal)
+print("Embedding:", read_fingerprint(INDEX_DIR))
+check_fingerprint(INDEX_DIR, embedding, vectorstore.index.d)
 
 # 4. 内部ドキュメントを取り出して確認
 #    docstore._dict に Document オブジェクトが格納されています
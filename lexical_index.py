@@ -0,0 +1,99 @@
+# lexical_index.py
+#
+# 店名・住所・駅名用の文字 n-gram BM25 転置インデックス。
+# add_reviews_to_faiss.py が page_content の先頭に付けるヘッダ
+# （標題 / 地址 / 捷運站 / 公車站）だけを対象にする。
+# 「一風堂」「中山站」のような固有名詞を、埋め込み検索より確実に拾うためのもの。
+
+import re
+import unicodedata
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+HEADER_FIELDS = ("標題", "地址", "捷運站", "公車站")
+
+_CJK_RUN = re.compile(r"[぀-ヿ㐀-䶿一-鿿豈-﫿]+")
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def header_text(page_content: str) -> str:
+    """ヘッダ部（最初の空行まで）から対象フィールドの値だけを取り出す"""
+    head = (page_content or "").split("\n\n", 1)[0]
+    vals = []
+    for line in head.splitlines():
+        key, sep, val = line.partition("：")
+        if sep and key.strip() in HEADER_FIELDS:
+            vals.append(val.strip())
+    return "\n".join(vals)
+
+
+def tokenize(text: str) -> List[str]:
+    """CJK は 1-gram + 2-gram、英数字は単語単位"""
+    s = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for run in _CJK_RUN.findall(s):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_WORD.findall(s))
+    return tokens
+
+
+class LexicalIndex:
+    def __init__(self, texts: Iterable[str], k1: float = 1.2, b: float = 0.75):
+        vocab: Dict[str, int] = {}
+        post_term, post_doc, post_tf = [], [], []
+        doc_len = []
+        for doc_id, text in enumerate(texts):
+            toks = tokenize(text)
+            doc_len.append(len(toks))
+            counts: Dict[int, int] = {}
+            for t in toks:
+                tid = vocab.setdefault(t, len(vocab))
+                counts[tid] = counts.get(tid, 0) + 1
+            for tid, tf in counts.items():
+                post_term.append(tid)
+                post_doc.append(doc_id)
+                post_tf.append(tf)
+
+        self.n_docs = len(doc_len)
+        self._vocab = vocab
+        term = np.asarray(post_term, dtype=np.int64)
+        docs = np.asarray(post_doc, dtype=np.int64)
+        tf = np.asarray(post_tf, dtype=np.float32)
+        dl = np.asarray(doc_len, dtype=np.float32)
+
+        # CSR 形式（term ごとに連続）に並べ、BM25 の重みを事前計算しておく
+        order = np.argsort(term, kind="stable")
+        term, docs, tf = term[order], docs[order], tf[order]
+        df = np.bincount(term, minlength=len(vocab)).astype(np.float32)
+        self._indptr = np.concatenate([[0], np.cumsum(df)]).astype(np.int64)
+        self._docs = docs.astype(np.int32)
+
+        avgdl = float(dl.mean()) if len(dl) else 1.0
+        idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5))
+        norm = k1 * (1 - b + b * dl[docs] / max(avgdl, 1e-6)) if len(docs) else np.empty(0)
+        self._weights = (idf[term] * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    @classmethod
+    def from_page_contents(cls, contents: Iterable[str]) -> "LexicalIndex":
+        return cls(header_text(c) for c in contents)
+
+    def search(self, query: str, k: int = 10):
+        """BM25 スコアの高い順に (行番号, スコア) を返す（スコア 0 は除く）"""
+        tids = {self._vocab[t] for t in tokenize(query) if t in self._vocab}
+        if not tids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        spans = [(self._indptr[t], self._indptr[t + 1]) for t in tids]
+        docs = np.concatenate([self._docs[s:e] for s, e in spans])
+        w = np.concatenate([self._weights[s:e] for s, e in spans])
+        scores = np.bincount(docs, weights=w, minlength=self.n_docs)
+
+        hit = np.flatnonzero(scores > 0)
+        if len(hit) > k:
+            hit = hit[np.argpartition(-scores[hit], k - 1)[:k]]
+        hit = hit[np.argsort(-scores[hit], kind="stable")]
+        return hit.astype(np.int64), scores[hit]
@@ -6,19 +6,27 @@ import os
 import re
 import logging
 import sys
+import asyncio
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 from urllib.parse import (
     urlsplit, urlunsplit, parse_qs, parse_qsl, quote, urlencode
 )
 
-import requests
+import httpx
 from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from linebot import LineBotApi, WebhookParser
 from linebot.models import FlexSendMessage
 from linebot.exceptions import InvalidSignatureError
 
+import geo_utils
+import ramen_qa
 from ramen_qa import answer_ramen
-from geo_utils import extract_location_from_text  # 地名→座標
+from request_context import build_context  # 言語・地名→座標・翻訳を1回で
+from photo_cache import PhotoDiskCache, etag_matches
+from photo_pack import PhotoPack
 
 # =========================
 # ロギング
@@ -45,11 +53,73 @@ GOOGLE_API_KEY  = os.getenv("GOOGLE_MAPS_API_KEY") or os.getenv("GOOGLE_API_KEY"
 logger.info(f"🌐 PUBLIC_BASE_URL = {PUBLIC_BASE_URL or '(empty)'}")
 logger.info(f"🔑 GOOGLE_API_KEY set = {bool(GOOGLE_API_KEY)}")
 
+# /photo のディスクキャッシュ
+PHOTO_CACHE_DIR = os.getenv("PHOTO_CACHE_DIR", "photo_cache")
+PHOTO_CACHE_MAX_MB = int(os.getenv("PHOTO_CACHE_MAX_MB", "512"))
+# photo_reference ごとに画像は不変なので長期キャッシュさせる
+PHOTO_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Places Photo API への接続（keep-alive で使い回す）
+PHOTO_UPSTREAM_TIMEOUT = float(os.getenv("PHOTO_UPSTREAM_TIMEOUT", "15"))
+PHOTO_HTTP_MAX_CONNECTIONS = int(os.getenv("PHOTO_HTTP_MAX_CONNECTIONS", "20"))
+PHOTO_CHUNK_SIZE = 64 * 1024
+# prefetch_photos.py が作る事前切り出し済みパック（あれば最優先で使う）
+PHOTO_PACK_DIR = os.getenv("PHOTO_PACK_DIR", "photo_pack")
+PHOTO_DEFAULT_WIDTH = int(os.getenv("PHOTO_DEFAULT_WIDTH", "960"))
+# インデックスの新しい版（faiss_index_versions/CURRENT）を確認する間隔。0 なら監視しない
+INDEX_WATCH_INTERVAL_SEC = float(os.getenv("INDEX_WATCH_INTERVAL_SEC", "60"))
+# /admin/* 用のトークン（未設定なら /admin/* は無効）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
 if not LINE_CHANNEL_SECRET or not LINE_CHANNEL_TOKEN:
     raise RuntimeError("LINE_CHANNEL_SECRET と LINE_CHANNEL_TOKEN を設定してください")
 
 line_bot_api = LineBotApi(LINE_CHANNEL_TOKEN)
 parser = WebhookParser(LINE_CHANNEL_SECRET)
+photo_cache = PhotoDiskCache(PHOTO_CACHE_DIR, PHOTO_CACHE_MAX_MB * 1024 * 1024)
+
+photo_pack: Optional[PhotoPack] = None
+try:
+    photo_pack = PhotoPack(PHOTO_PACK_DIR)
+    logger.info(f"🖼️ photo pack loaded: {len(photo_pack)} variants widths={photo_pack.widths}")
+except FileNotFoundError:
+    logger.info(f"🖼️ photo pack not found at '{PHOTO_PACK_DIR}' (upstream fetch only)")
+
+_photo_client: Optional[httpx.AsyncClient] = None
+# 取得中の photo_reference → _InflightPhoto（同じ写真の同時取得を1本にまとめる）
+_photo_inflight: dict = {}
+_photo_fetch_tasks: set = set()
+
+# =========================
+# Webhook ワーカー設定
+# =========================
+# queue: 署名検証だけして即 200、処理はワーカーで行う / inline: リクエスト内で処理
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "queue").lower()
+WORKER_CONCURRENCY = max(1, int(os.getenv("WORKER_CONCURRENCY", "4")))
+WORKER_QUEUE_MAX = max(1, int(os.getenv("WORKER_QUEUE_MAX", "100")))
+# キューが溢れたとき: drop_oldest(最古を捨てる) | drop_new(新着を捨てる) | reject(503 を返し LINE に再送させる)
+WORKER_OVERFLOW_POLICY = os.getenv("WORKER_OVERFLOW_POLICY", "drop_oldest").lower()
+# reply token は約1分で失効するため、それより古いイベントは処理しない
+EVENT_MAX_AGE_SEC = float(os.getenv("EVENT_MAX_AGE_SEC", "50"))
+# 1つの Webhook body 内のイベントを同時に処理する上限（inline モード）
+EVENT_FANOUT_MAX = max(1, int(os.getenv("EVENT_FANOUT_MAX", "5")))
+# 停止時、キューに残ったイベント（LINE には 200 済み）を処理し終えるまで待つ上限
+WORKER_DRAIN_TIMEOUT_SEC = float(os.getenv("WORKER_DRAIN_TIMEOUT_SEC", "30"))
+
+logger.info(
+    f"⚙️ WEBHOOK_MODE={WEBHOOK_MODE} workers={WORKER_CONCURRENCY} "
+    f"queue_max={WORKER_QUEUE_MAX} overflow={WORKER_OVERFLOW_POLICY} fanout={EVENT_FANOUT_MAX}"
+)
+
+# LLM / 外部 API のブロッキング呼び出しはこのスレッドプールで実行する
+_executor = ThreadPoolExecutor(
+    max_workers=max(WORKER_CONCURRENCY, EVENT_FANOUT_MAX), thread_name_prefix="line-worker"
+)
+_event_queue: Optional[asyncio.Queue] = None
+_worker_tasks: list = []
+_warmup_task: Optional[asyncio.Future] = None
+_index_watch_task: Optional[asyncio.Task] = None
+# 停止処理に入ったら True（以降のイベントはキューに積まず inline で処理する）
+_draining = False
 
 # =========================
 # ラベル正規化
@@ -250,33 +320,179 @@ def _extract_ref_from_url(url: str) -> str:
 # =========================
 # /photo プロキシ (Places Photo API)
 # =========================
+def _photo_format(ref: str) -> str:
+    """拡張子からパック内のフォーマットを決める（LINE は JPEG 前提）"""
+    return "webp" if ref.lower().endswith(".webp") else "jpeg"
+
+def _parse_photo_ref(ref: str) -> str:
+    """/photo/<photo_reference>.jpg や URL 丸ごとから photo_reference を取り出す"""
+    # 拡張子剥がし
+    for ext in (".jpg", ".jpeg", ".png", ".webp"):
+        if ref.lower().endswith(ext):
+            ref = ref[: -len(ext)]
+            break
+
+    # URL 丸ごと → photo_reference 抽出
+    if ref.startswith("http"):
+        qs = parse_qs(urlsplit(ref).query)
+        ref = qs.get("photo_reference", [None])[0] or ref
+    return ref
+
+async def _read_cached_photo(fp):
+    """photo_cache.get が開いたファイルを読み切る（パスを開き直すと、その間に消されることがある）"""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, fp.read, PHOTO_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        fp.close()
+
+def _cached_photo_response(cached, if_none_match: str):
+    headers = {"Cache-Control": PHOTO_CACHE_CONTROL, "ETag": cached.etag}
+    if etag_matches(if_none_match, cached.etag):
+        cached.file.close()
+        return Response(status_code=304, headers=headers)
+    headers["Content-Length"] = str(cached.size)
+    return StreamingResponse(_read_cached_photo(cached.file), media_type=cached.content_type, headers=headers)
+
+def _packed_photo_response(entry, if_none_match: str):
+    headers = {"Cache-Control": PHOTO_CACHE_CONTROL, "ETag": entry.etag}
+    if etag_matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=photo_pack.read(entry), media_type=entry.content_type, headers=headers)
+
+def _get_photo_client() -> httpx.AsyncClient:
+    global _photo_client
+    if _photo_client is None:
+        _photo_client = httpx.AsyncClient(
+            timeout=PHOTO_UPSTREAM_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=PHOTO_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=PHOTO_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return _photo_client
+
+class _InflightPhoto:
+    """上流から取得中の写真。取得は1本のタスクで行い、各クライアントはこのバッファを先頭から読む。
+    取得の速さはどのクライアントの受信速度にも左右されない"""
+
+    def __init__(self):
+        self.content_type = ""
+        self.chunks: list = []
+        self.finished = False  # 全部届いてキャッシュにも書けた
+        self.failed = False
+        self.ready = asyncio.Event()  # Content-Type が決まった（または失敗した）
+        self._changed = asyncio.Event()
+
+    def start(self, content_type: str) -> None:
+        self.content_type = content_type
+        self.ready.set()
+
+    def append(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def close(self, ok: bool) -> None:
+        self.finished, self.failed = ok, not ok
+        self.ready.set()
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def stream(self):
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.finished:
+                return
+            if self.failed:
+                # 途中で切れた画像を完全な応答に見せない（接続ごと切る）
+                raise RuntimeError("upstream photo fetch failed")
+            await self._changed.wait()
+
+async def _fetch_photo(ref: str, resp: httpx.Response, writer, inflight: _InflightPhoto):
+    """上流のバイト列をバッファに積みつつディスクキャッシュに書く（ファイル I/O はイベントループの外で）"""
+    loop = asyncio.get_running_loop()
+    ok = False
+    try:
+        async for chunk in resp.aiter_bytes(PHOTO_CHUNK_SIZE):
+            inflight.append(chunk)
+            await loop.run_in_executor(None, writer.write, chunk)
+        await loop.run_in_executor(None, writer.commit)
+        ok = True
+    except Exception as e:
+        logger.warning(f"/photo upstream stream failed ref={ref[:16]}…: {e}")
+    finally:
+        if not ok:
+            # 中途半端なファイルは残さない
+            writer.abort()
+        _photo_inflight.pop(ref, None)
+        inflight.close(ok)
+        await resp.aclose()
+
+def _inflight_photo_response(inflight: _InflightPhoto):
+    return StreamingResponse(
+        inflight.stream(),
+        media_type=inflight.content_type or "image/jpeg",
+        headers={"Cache-Control": PHOTO_CACHE_CONTROL},
+    )
+
 @app.get("/photo/{ref:path}")
-def photo_proxy(ref: str):
+async def photo_proxy(ref: str, request: Request, w: Optional[int] = None):
     """
     Google Places Photo を安全にプロキシする。
-    - /photo/<photo_reference>.jpg 形式に対応（拡張子は捨てる）
+    - /photo/<photo_reference>.jpg 形式に対応（.webp ならパックの WebP を返す）
+    - ?w=<幅> でパック内のバリアント幅を選ぶ（既定 PHOTO_DEFAULT_WIDTH）
     - ref に URL 丸ごとも来たら photo_reference を抽出
+    - 事前切り出し済みパックにあればそこから返す（ネットワークに出ない）
+    - 取得した画像はディスクにキャッシュし、ETag / If-None-Match で 304 を返す
+    - 同じ ref の同時リクエストは上流取得を1本にまとめ、取得中のバッファをそれぞれに流す
     """
     try:
         logger.info(f"📸 /photo hit ref(raw)='{ref}'")
         orig_ref = ref
-
-        # 拡張子剥がし
-        for ext in (".jpg", ".jpeg", ".png", ".webp"):
-            if ref.lower().endswith(ext):
-                ref = ref[: -len(ext)]
-                break
-
-        # URL 丸ごと → photo_reference 抽出
-        if ref.startswith("http"):
-            qs = parse_qs(urlsplit(ref).query)
-            ref = qs.get("photo_reference", [None])[0] or ref
+        fmt = _photo_format(ref)
+        ref = _parse_photo_ref(ref)
 
         # 形チェック
         if not ref or len(ref) < 10:
             logger.warning(f"/photo invalid ref: orig='{orig_ref}' parsed='{ref}'")
             return Response(status_code=204)
 
+        if_none_match = request.headers.get("If-None-Match", "")
+        if photo_pack is not None:
+            entry = photo_pack.lookup(ref, width=w or PHOTO_DEFAULT_WIDTH, fmt=fmt)
+            if entry:
+                return _packed_photo_response(entry, if_none_match)
+
+        loop = asyncio.get_running_loop()
+        # ディスクを読むのでイベントループの外で
+        cached = await loop.run_in_executor(None, photo_cache.get, ref)
+        if cached:
+            logger.debug(f"/photo cache hit ref={ref[:16]}…")
+            return _cached_photo_response(cached, if_none_match)
+
+        inflight = _photo_inflight.get(ref)
+        if inflight is not None:
+            # 先行リクエストが取得中：Content-Type が決まり次第、同じバッファを流す
+            try:
+                await asyncio.wait_for(inflight.ready.wait(), PHOTO_UPSTREAM_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"/photo wait timeout ref={ref[:16]}…")
+                return Response(status_code=204)
+            if inflight.failed and not inflight.chunks:
+                return Response(status_code=204)
+            return _inflight_photo_response(inflight)
+
         if not GOOGLE_API_KEY:
             logger.error("GOOGLE_API_KEY is not set")
             return Response(status_code=204)
@@ -287,20 +503,42 @@ def photo_proxy(ref: str):
         )
         logger.debug(f"/photo fetch -> {google_url.replace(GOOGLE_API_KEY, '***')}")
 
-        r = requests.get(google_url, timeout=15, allow_redirects=True)
+        inflight = _InflightPhoto()
+        _photo_inflight[ref] = inflight
+        try:
+            client = _get_photo_client()
+            r = await client.send(client.build_request("GET", google_url), stream=True)
+        except BaseException:
+            _photo_inflight.pop(ref, None)
+            inflight.close(False)
+            raise
+
         ctype = r.headers.get("Content-Type", "")
-        logger.debug(f"/photo resp status={r.status_code} ctype='{ctype}' bytes={len(r.content) if r.ok else 0}")
+        logger.debug(f"/photo resp status={r.status_code} ctype='{ctype}'")
 
         if r.status_code != 200 or not ctype.startswith("image/"):
-            body_head = r.text[:120] if hasattr(r, "text") else ""
+            try:
+                body_head = (await r.aread())[:120]
+            finally:
+                await r.aclose()
+                _photo_inflight.pop(ref, None)
+                inflight.close(False)
             logger.warning(f"/photo non-image or error: status={r.status_code} ctype='{ctype}' body_head={body_head!r}")
             return Response(status_code=204)
 
-        return Response(
-            content=r.content,
-            media_type=ctype or "image/jpeg",
-            headers={"Cache-Control": "public, max-age=86400"},
-        )
+        try:
+            writer = await loop.run_in_executor(None, photo_cache.open_writer, ref, ctype or "image/jpeg")
+        except BaseException:
+            await r.aclose()
+            _photo_inflight.pop(ref, None)
+            inflight.close(False)
+            raise
+        inflight.start(ctype or "image/jpeg")
+        # 取得はクライアントとは独立したタスクで（遅い/切断したクライアントに引きずられない）
+        task = asyncio.create_task(_fetch_photo(ref, r, writer, inflight))
+        _photo_fetch_tasks.add(task)
+        task.add_done_callback(_photo_fetch_tasks.discard)
+        return _inflight_photo_response(inflight)
     except Exception as e:
         logger.exception(f"/photo fatal error: {e}")
         return Response(status_code=204)
@@ -452,6 +690,220 @@ def build_ramen_flex(data: dict, photo_url: str = "", locale: str = "zh") -> dic
 
     return flex
 
+# =========================
+# イベント処理（ワーカースレッドで実行）
+# =========================
+def _photo_base_url(request: Request) -> str:
+    """/photo の絶対URLベース。ワーカーはリクエストを持たないので受付時に決めておく"""
+    if PUBLIC_BASE_URL:
+        return f"{PUBLIC_BASE_URL}/photo"
+    # ローカルURL（http→https 補正）
+    base = str(request.base_url).rstrip("/")
+    if base.startswith("http://"):
+        base = "https://" + base[len("http://"):]
+    return f"{base}/photo"
+
+def _build_photo_url(photo_base: str, ref: str) -> str:
+    # 同じ写真は常に同じURL（LINE / CDN のキャッシュを効かせる）
+    return f"{photo_base}/{ref}.jpg"
+
+def _is_stale(event) -> bool:
+    ts = getattr(event, "timestamp", None)
+    if not ts:
+        return False
+    return (time.time() * 1000 - ts) > EVENT_MAX_AGE_SEC * 1000
+
+def _handle_event(event, photo_base: str) -> None:
+    """1イベント分の 検索→生成→返信。ブロッキング処理なのでスレッドで呼ぶこと"""
+    if not (event.type == "message" and event.message.type == "text"):
+        return
+
+    user_text = event.message.text
+    locale = detect_locale(user_text)
+
+    # 言語・検索用の中国語・地名の座標をここで1回だけ求め、answer_ramen にそのまま渡す
+    ctx = build_context(user_text, locale, GOOGLE_API_KEY)
+
+    # RAG検索
+    raw_replies = answer_ramen(user_text, metadata_filters=ctx.filters, context=ctx)
+
+    bubbles = []
+    for result in (raw_replies or [])[:10]:
+        data = parse_response_to_dict(result.get("text", ""))
+        if not data:
+            continue
+
+        # photo_reference を優先的に使う。なければ photo_url から抽出
+        ref = result.get("photo_ref", "") or _extract_ref_from_url(result.get("photo_url", ""))
+        photo_url = _build_photo_url(photo_base, ref) if ref else ""
+
+        logger.debug(f"🧩 photo_url for Flex: {photo_url}")
+
+        bubble = build_ramen_flex(data, photo_url=photo_url, locale=locale)
+        bubbles.append(bubble)
+
+    if not bubbles:
+        return
+
+    flex_carousel = {"type": "carousel", "contents": bubbles}
+    message = FlexSendMessage(alt_text="餐廳資訊", contents=flex_carousel)
+    line_bot_api.reply_message(event.reply_token, message)
+
+async def _process_events(events, photo_base: str) -> None:
+    """body 内のイベントを並列処理。1件の失敗が他のイベントを巻き込まないようにする"""
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(EVENT_FANOUT_MAX)
+
+    async def run_one(event):
+        async with sem:
+            await loop.run_in_executor(_executor, _handle_event, event, photo_base)
+
+    results = await asyncio.gather(*(run_one(ev) for ev in events), return_exceptions=True)
+    for event, res in zip(events, results):
+        if isinstance(res, Exception):
+            logger.error(
+                f"event failed: type={getattr(event, 'type', '?')} err={res!r}",
+                exc_info=(type(res), res, res.__traceback__),
+            )
+
+# =========================
+# ワーカープール
+# =========================
+async def _worker_loop(worker_id: int):
+    loop = asyncio.get_running_loop()
+    while True:
+        event, photo_base = await _event_queue.get()
+        try:
+            if _is_stale(event):
+                logger.warning(f"⌛ worker{worker_id}: stale event skipped (reply token expired)")
+                continue
+            await loop.run_in_executor(_executor, _handle_event, event, photo_base)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"worker{worker_id}: event failed: {e}")
+        finally:
+            _event_queue.task_done()
+
+def _enqueue_event(job) -> None:
+    """キューへ投入。満杯なら WORKER_OVERFLOW_POLICY に従って捨てる"""
+    try:
+        _event_queue.put_nowait(job)
+        return
+    except asyncio.QueueFull:
+        pass
+
+    if WORKER_OVERFLOW_POLICY == "drop_oldest":
+        try:
+            _event_queue.get_nowait()
+            _event_queue.task_done()
+            logger.warning("🚮 queue full: dropped oldest event")
+        except asyncio.QueueEmpty:
+            pass
+        _event_queue.put_nowait(job)
+    else:
+        logger.warning("🚮 queue full: dropped new event")
+
+def _warmup() -> None:
+    """FAISS・インデックス・LLM クライアントの読み込み（リクエストの外で1回だけ）"""
+    t0 = time.perf_counter()
+    try:
+        ramen_qa.warmup()
+        geo_utils.warmup()
+        logger.info(f"🔥 warmup done in {time.perf_counter() - t0:.1f}s")
+    except Exception as e:
+        # 失敗しても起動は続ける（/readyz が 503 を返し、最初のリクエストで再試行される）
+        logger.exception(f"warmup failed: {e}")
+
+@app.on_event("startup")
+async def _start_warmup():
+    global _warmup_task
+    _warmup_task = asyncio.get_running_loop().run_in_executor(_executor, _warmup)
+
+async def _index_watch_loop():
+    """CURRENT が変わったら新しい版を読み込んで差し替える（読み込みはスレッドで、応答は止めない）"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(INDEX_WATCH_INTERVAL_SEC)
+        if not ramen_qa.is_ready():
+            continue  # 初回の読み込みは warmup に任せる
+        try:
+            result = await loop.run_in_executor(_executor, ramen_qa.reload_index)
+            if result.get("reloaded"):
+                logger.info(f"🔄 index reloaded: {result}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"index reload failed (keeping current version): {e}")
+
+@app.on_event("startup")
+async def _start_index_watch():
+    global _index_watch_task
+    if INDEX_WATCH_INTERVAL_SEC > 0:
+        _index_watch_task = asyncio.create_task(_index_watch_loop())
+
+@app.on_event("startup")
+async def _start_workers():
+    global _event_queue
+    if WEBHOOK_MODE != "queue":
+        return
+    _event_queue = asyncio.Queue(maxsize=WORKER_QUEUE_MAX)
+    for i in range(WORKER_CONCURRENCY):
+        _worker_tasks.append(asyncio.create_task(_worker_loop(i)))
+    logger.info(f"🧵 started {WORKER_CONCURRENCY} webhook workers")
+
+@app.on_event("shutdown")
+async def _stop_workers():
+    global _photo_client, _draining
+    if _index_watch_task is not None:
+        _index_watch_task.cancel()
+    # キューの分は LINE に 200 を返してあるので、捨てずに返信まで済ませてから止める
+    _draining = True
+    if _event_queue is not None and _worker_tasks:
+        try:
+            await asyncio.wait_for(_event_queue.join(), timeout=WORKER_DRAIN_TIMEOUT_SEC)
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱️ drain timed out: {_event_queue.qsize()} queued events dropped")
+    for t in _worker_tasks:
+        t.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
+    _executor.shutdown(wait=False)
+    if _photo_client is not None:
+        await _photo_client.aclose()
+        _photo_client = None
+
+# =========================
+# ヘルスチェック
+# =========================
+@app.get("/healthz")
+async def healthz():
+    """プロセスが生きているか（読み込み中でも 200）"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """検索・回答できる状態か。読み込み中 / 失敗中は 503"""
+    if ramen_qa.is_ready():
+        return {"status": "ready", "index_version": ramen_qa.index_version()}
+    detail = ramen_qa.init_error()
+    status = "error" if detail else "loading"
+    return JSONResponse({"status": status, "detail": detail}, status_code=503)
+
+@app.post("/admin/reload-index")
+async def admin_reload_index(request: Request, force: bool = False):
+    """新しい版のインデックスを今すぐ読み込んで差し替える（X-Admin-Token が必要）"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404)
+    if request.headers.get("X-Admin-Token", "") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_executor, ramen_qa.reload_index, force)
+    except Exception as e:
+        logger.exception(f"index reload failed (keeping current version): {e}")
+        raise HTTPException(status_code=500, detail=f"reload failed: {e}")
+
 # =========================
 # Webhook
 # =========================
@@ -467,51 +919,22 @@ async def callback(request: Request):
     except InvalidSignatureError:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    for event in events:
-        if event.type == "message" and event.message.type == "text":
-            user_text = event.message.text
-            locale = detect_locale(user_text)
-
-            # 地名→座標→metadata_filter
-            lat, lng = extract_location_from_text(user_text, GOOGLE_API_KEY)
-            metadata_filter = {"location": {"lat": lat, "lng": lng}} if (lat is not None and lng is not None) else None
-
-            # RAG検索（古いシグネチャ互換）
-            try:
-                raw_replies = answer_ramen(user_text, metadata_filters=metadata_filter)
-            except TypeError:
-                raw_replies = answer_ramen(user_text)
-
-            bubbles = []
-            for result in (raw_replies or [])[:10]:
-                data = parse_response_to_dict(result.get("text", ""))
-                if not data:
-                    continue
-
-                # photo_reference を優先的に使う。なければ photo_url から抽出
-                ref = result.get("photo_ref", "") or _extract_ref_from_url(result.get("photo_url", ""))
-                if ref:
-                    if PUBLIC_BASE_URL:
-                        photo_url = f"{PUBLIC_BASE_URL}/photo/{ref}.jpg?v={int(time.time())}"
-                    else:
-                        # ローカルURL（http→https 補正 & キャッシュバスター）
-                        tmp = str(request.url_for("photo_proxy", ref=f"{ref}.jpg"))
-                        if tmp.startswith("http://"):
-                            tmp = "https://" + tmp[len("http://"):]
-                        photo_url = tmp + ("&" if "?" in tmp else "?") + f"v={int(time.time())}"
-                else:
-                    photo_url = ""
-
-                logger.debug(f"🧩 photo_url for Flex: {photo_url}")
-
-                bubble = build_ramen_flex(data, photo_url=photo_url, locale=locale)
-                bubbles.append(bubble)
-
-            if not bubbles:
-                return "OK"
-
-            flex_carousel = {"type": "carousel", "contents": bubbles}
-            message = FlexSendMessage(alt_text="餐廳資訊", contents=flex_carousel)
-            line_bot_api.reply_message(event.reply_token, message)
+    photo_base = _photo_base_url(request)
+
+    if WEBHOOK_MODE == "queue" and _event_queue is not None and not _draining:
+        if (
+            WORKER_OVERFLOW_POLICY == "reject"
+            and _event_queue.qsize() + len(events) > WORKER_QUEUE_MAX
+        ):
+            # 一部だけ積むと再送時に重複するので、丸ごと断る
+            logger.warning(f"🚫 queue full ({_event_queue.qsize()}): rejecting {len(events)} events")
+            raise HTTPException(status_code=503, detail="Busy")
+        # イベント単位で積むので、同じ body のイベントも別々のワーカーで並列に処理される
+        for event in events:
+            _enqueue_event((event, photo_base))
+        return "OK"
+
+    # inline モード：イベントループを塞がないようスレッドで並列処理
+    await _process_events(events, photo_base)
 
     return "OK"
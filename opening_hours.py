@@ -0,0 +1,147 @@
+# opening_hours.py
+#
+# Google Places の opening_hours.weekday_text（自由記述）を
+# 1週間 × 15分刻み = 672 スロットのビットマップ（84 バイト）に変換する。
+# 取り込み時（add_reviews_to_faiss.py）に metadata["open_slots"] へ hex で保存し、
+# 検索時は全店舗分を (件数, 84) の uint8 行列にして「今開いているか」を一括で引く。
+
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+TAIPEI_TZ = ZoneInfo("Asia/Taipei")
+SLOT_MIN = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MIN
+WEEK_SLOTS = 7 * SLOTS_PER_DAY
+PACKED_BYTES = WEEK_SLOTS // 8
+
+# 月曜 = 0（datetime.weekday() と同じ）
+_DAY_NAMES = [
+    ("星期一", "週一", "Monday", "月曜日"),
+    ("星期二", "週二", "Tuesday", "火曜日"),
+    ("星期三", "週三", "Wednesday", "水曜日"),
+    ("星期四", "週四", "Thursday", "木曜日"),
+    ("星期五", "週五", "Friday", "金曜日"),
+    ("星期六", "週六", "Saturday", "土曜日"),
+    ("星期日", "星期天", "週日", "Sunday", "日曜日"),
+]
+_CLOSED = re.compile(r"休息|公休|定休|closed|休業", re.IGNORECASE)
+_ALL_DAY = re.compile(r"24\s*小時|24\s*hours|24\s*時間", re.IGNORECASE)
+_TIME = r"(上午|中午|下午|晚上|凌晨)?\s*(\d{1,2})\s*[:：時]\s*(\d{2})?\s*分?\s*(AM|PM|am|pm)?"
+_RANGE = re.compile(_TIME + r"\s*[–—\-~〜～至]\s*" + _TIME)
+
+
+def _day_of(line: str) -> Optional[int]:
+    for i, names in enumerate(_DAY_NAMES):
+        if any(line.startswith(n) for n in names):
+            return i
+    return None
+
+
+def _minutes(prefix, hour, minute, ampm) -> int:
+    h, m = int(hour), int(minute or 0)
+    pm = (ampm or "").lower() == "pm" or prefix in ("下午", "晚上")
+    am = (ampm or "").lower() == "am" or prefix in ("上午", "凌晨")
+    if pm and h < 12:
+        h += 12
+    elif am and h == 12:
+        h = 0
+    return min(h * 60 + m, 24 * 60)
+
+
+def _range_minutes(groups) -> tuple:
+    """1つの範囲の (開始, 終了) 分。開始側に午前/午後がなければ終了側のものに合わせる"""
+    s_prefix, s_hour, s_minute, s_ampm = groups[:4]
+    e_prefix, _, _, e_ampm = groups[4:]
+    end = _minutes(*groups[4:])
+    if not s_prefix and not s_ampm and (e_prefix or e_ampm):
+        # 5:00 – 10:00 PM → 17:00–22:00。合わせると終了より後になるなら午前のまま（11:00 – 2:00 PM）
+        start = _minutes(e_prefix, s_hour, s_minute, e_ampm)
+        if start > end:
+            start = _minutes(None, s_hour, s_minute, None)
+        return start, end
+    return _minutes(*groups[:4]), end
+
+
+def parse_weekday_text(weekday_text: Optional[List[str]]) -> Optional[np.ndarray]:
+    """672 要素の bool 配列。データがなければ None"""
+    if not weekday_text:
+        return None
+    week = np.zeros(WEEK_SLOTS, dtype=bool)
+    parsed_any = False
+    for line in weekday_text:
+        line = (line or "").strip()
+        day = _day_of(line)
+        if day is None:
+            continue
+        body = re.split(r"[:：]", line, maxsplit=1)[-1]
+        base = day * SLOTS_PER_DAY
+        if _CLOSED.search(body):
+            parsed_any = True
+            continue
+        if _ALL_DAY.search(body):
+            week[base: base + SLOTS_PER_DAY] = True
+            parsed_any = True
+            continue
+        for m in _RANGE.finditer(body):
+            start, end = _range_minutes(m.groups())
+            if end <= start:
+                end += 24 * 60  # 日付をまたぐ（例 18:00 – 02:00）
+            s = base + start // SLOT_MIN
+            e = base + -(-end // SLOT_MIN)
+            idx = np.arange(s, e) % WEEK_SLOTS  # 日曜深夜 → 月曜へ
+            week[idx] = True
+            parsed_any = True
+    return week if parsed_any else None
+
+
+def encode(week: Optional[np.ndarray]) -> Optional[str]:
+    if week is None:
+        return None
+    return np.packbits(week, bitorder="little").tobytes().hex()
+
+
+def slot_of(dt: datetime) -> int:
+    dt = dt.astimezone(TAIPEI_TZ) if dt.tzinfo else dt
+    return dt.weekday() * SLOTS_PER_DAY + (dt.hour * 60 + dt.minute) // SLOT_MIN
+
+
+def now_taipei() -> datetime:
+    return datetime.now(TAIPEI_TZ)
+
+
+def tonight_taipei(hour: int = 23) -> datetime:
+    now = now_taipei()
+    t = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    # 日付が変わった直後（0〜4時台）は「今夜」= 今
+    return now if now.hour < 5 else t
+
+
+class OpenHoursIndex:
+    def __init__(self, packed: np.ndarray, known: np.ndarray):
+        self.packed = packed  # (件数, PACKED_BYTES) uint8
+        self.known = known    # 営業時間データの有無
+
+    @classmethod
+    def from_metadatas(cls, metadatas: List[dict]) -> "OpenHoursIndex":
+        packed = np.zeros((len(metadatas), PACKED_BYTES), dtype=np.uint8)
+        known = np.zeros(len(metadatas), dtype=bool)
+        for row, md in enumerate(metadatas):
+            md = md or {}
+            hex_ = md.get("open_slots")
+            if not hex_:
+                # 古いインデックス（open_slots なし）はその場で解析
+                hex_ = encode(parse_weekday_text((md.get("opening_hours") or {}).get("weekday_text")))
+            if hex_:
+                packed[row] = np.frombuffer(bytes.fromhex(hex_), dtype=np.uint8)
+                known[row] = True
+        return cls(packed, known)
+
+    def open_at(self, dt: datetime, include_unknown: bool = False) -> np.ndarray:
+        """dt に営業中の行を True にした bool 配列（1スロット分の列を見るだけ）"""
+        slot = slot_of(dt)
+        is_open = ((self.packed[:, slot >> 3] >> (slot & 7)) & 1).astype(bool)
+        return is_open | ~self.known if include_unknown else is_open
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# photo_cache.py
+#
+# /photo プロキシ用のディスクキャッシュ
+# - キーは photo_reference（sha256 でファイル名化）
+# - 合計サイズが上限を超えたら、最後に使われたのが古い順（mtime）に削除（LRU）
+# - ETag は画像本体の sha256
+# - serve.py の prefork で複数プロセスが同じディレクトリを使うので、
+#   合計サイズは root/.total_bytes に置き、読み出し・書き込み・削除は root/.lock の flock で排他する
+# - get() はロック中にファイルを開いて返す（開いた後に削除されても読み切れる）
+
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import threading
+import tempfile
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger("line_app")
+
+# file は get() が開いたファイル（読み終えたら呼び出し側で close する）。書き込み側の戻り値では None
+CachedPhoto = namedtuple("CachedPhoto", ["path", "etag", "content_type", "size", "file"], defaults=(None,))
+
+
+def _key_for(ref: str) -> str:
+    return hashlib.sha256(ref.encode("utf-8")).hexdigest()
+
+
+class _Writer:
+    """チャンクを一時ファイルに書き、commit() でキャッシュへ原子的に移す"""
+
+    def __init__(self, cache: "PhotoDiskCache", ref: str, content_type: str):
+        self._cache = cache
+        self._ref = ref
+        self._content_type = content_type
+        self._hash = hashlib.sha256()
+        self._size = 0
+        fd, self._tmp_path = tempfile.mkstemp(dir=cache.tmp_dir, suffix=".part")
+        self._fp = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self._fp.write(chunk)
+        self._hash.update(chunk)
+        self._size += len(chunk)
+
+    def commit(self) -> CachedPhoto:
+        self._fp.close()
+        etag = f'"{self._hash.hexdigest()[:32]}"'
+        return self._cache._install(self._ref, self._tmp_path, etag, self._content_type, self._size)
+
+    def abort(self) -> None:
+        try:
+            self._fp.close()
+        finally:
+            try:
+                os.remove(self._tmp_path)
+            except FileNotFoundError:
+                pass
+
+
+class PhotoDiskCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._lock_fp = None
+        self._lock_pid = None
+        with self._locked():
+            files = self._scan()
+            total = sum(size for _, _, size in files)
+            self._write_total(total)
+        logger.info(f"🗂️ photo cache: {len(files)} files, {total / 1e6:.1f} MB in '{self.root}'")
+
+    # ---------- パス ----------
+    def _paths(self, key: str):
+        d = os.path.join(self.root, key[:2])
+        return d, os.path.join(d, key), os.path.join(d, key + ".json")
+
+    @contextmanager
+    def _locked(self):
+        """スレッド間は self._lock、プロセス間は root/.lock の flock（fork 後の子プロセスでは開き直す）"""
+        with self._lock:
+            if self._lock_fp is None or self._lock_pid != os.getpid():
+                self._lock_fp = open(os.path.join(self.root, ".lock"), "a+b")
+                self._lock_pid = os.getpid()
+            fcntl.flock(self._lock_fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fp, fcntl.LOCK_UN)
+
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        """キャッシュ内のファイルを古い順に (mtime, key, bytes)"""
+        found = []
+        for sub in os.listdir(self.root):
+            d = os.path.join(self.root, sub)
+            if sub == "tmp" or not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                if name.endswith(".json"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(d, name))
+                except FileNotFoundError:
+                    continue
+                found.append((st.st_mtime, name, st.st_size))
+        return sorted(found)
+
+    # ---------- 合計サイズ（全プロセスで共有。ロック中に読み書きする） ----------
+    def _read_total(self) -> int:
+        try:
+            with open(os.path.join(self.root, ".total_bytes"), "r") as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return sum(size for _, _, size in self._scan())
+
+    def _write_total(self, total: int) -> None:
+        with open(os.path.join(self.root, ".total_bytes"), "w") as f:
+            f.write(str(total))
+
+    # ---------- 読み出し ----------
+    def get(self, ref: str) -> Optional[CachedPhoto]:
+        key = _key_for(ref)
+        _, data_path, meta_path = self._paths(key)
+        with self._locked():
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                fp = open(data_path, "rb")
+                os.utime(data_path)  # LRU 順（全プロセス・再起動後も共通）
+            except (FileNotFoundError, ValueError):
+                return None
+        return CachedPhoto(data_path, meta["etag"], meta["content_type"], meta["size"], fp)
+
+    # ---------- 書き込み ----------
+    def open_writer(self, ref: str, content_type: str) -> _Writer:
+        return _Writer(self, ref, content_type)
+
+    def put(self, ref: str, content: bytes, content_type: str) -> CachedPhoto:
+        w = self.open_writer(ref, content_type)
+        try:
+            w.write(content)
+        except Exception:
+            w.abort()
+            raise
+        return w.commit()
+
+    def _install(self, ref: str, tmp_path: str, etag: str, content_type: str, size: int) -> CachedPhoto:
+        key = _key_for(ref)
+        d, data_path, meta_path = self._paths(key)
+        os.makedirs(d, exist_ok=True)
+
+        meta = {"ref": ref, "etag": etag, "content_type": content_type, "size": size}
+        fd, meta_tmp = tempfile.mkstemp(dir=self.tmp_dir, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        with self._locked():
+            try:
+                replaced = os.stat(data_path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            # 本体 → メタの順に置き換える（メタがあれば本体は必ず揃っている）
+            os.replace(tmp_path, data_path)
+            os.replace(meta_tmp, meta_path)
+            total = self._read_total() + size - replaced
+            if total > self.max_bytes:
+                total = self._evict_locked()
+            self._write_total(total)
+        return CachedPhoto(data_path, etag, content_type, size)
+
+    def _evict_locked(self) -> int:
+        """ディレクトリを走査して実際の合計を出し、上限以下になるまで古い順に消す。残った合計を返す"""
+        files = self._scan()
+        total = sum(size for _, _, size in files)
+        for _, key, size in files[:-1]:  # 最新（今入れたもの）は残す
+            if total <= self.max_bytes:
+                break
+            total -= size
+            _, data_path, meta_path = self._paths(key)
+            for p in (meta_path, data_path):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+            logger.debug(f"photo cache evicted {key[:12]} ({size} bytes)")
+        return total
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match ヘッダ（カンマ区切り / W/ 付き / *）と ETag を比較"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# photo_pack.py
+#
+# 事前に切り出した写真バリアントを1つの blob ファイルにまとめたもの
+#   <dir>/photos.pack      … 画像バイト列を連結しただけのファイル（mmap で読む）
+#   <dir>/photos.idx.json  … "<photo_reference>|<width>|<format>" → [offset, length, etag]
+# 作成は prefetch_photos.py、配信は line_bot.py の /photo
+
+import os
+import json
+import mmap
+import hashlib
+from collections import namedtuple
+from typing import Dict, List, Optional
+
+PACK_FILE = "photos.pack"
+INDEX_FILE = "photos.idx.json"
+
+CONTENT_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+PackedPhoto = namedtuple("PackedPhoto", ["offset", "length", "etag", "content_type"])
+
+
+def _entry_key(ref: str, width: int, fmt: str) -> str:
+    return f"{ref}|{width}|{fmt}"
+
+
+class PhotoPack:
+    """photos.pack を mmap し、photo_reference とサイズからバリアントを引く"""
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, INDEX_FILE), "r", encoding="utf-8") as f:
+            idx = json.load(f)
+        self.widths: List[int] = sorted(idx.get("widths", []))
+        self._entries: Dict[str, list] = idx["entries"]
+
+        self._fp = open(os.path.join(directory, PACK_FILE), "rb")
+        size = os.fstat(self._fp.fileno()).st_size
+        self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, ref: str, width: Optional[int] = None, fmt: str = "jpeg") -> Optional[PackedPhoto]:
+        """width 以上で最小のバリアント（無ければ最大のもの）を返す"""
+        if not self.widths:
+            return None
+        if width is None:
+            candidates = list(reversed(self.widths))
+        else:
+            larger = [w for w in self.widths if w >= width]
+            smaller = [w for w in reversed(self.widths) if w < width]
+            candidates = larger + smaller
+        for w in candidates:
+            e = self._entries.get(_entry_key(ref, w, fmt))
+            if e:
+                return PackedPhoto(e[0], e[1], e[2], CONTENT_TYPES[fmt])
+        return None
+
+    def read(self, entry: PackedPhoto) -> bytes:
+        return self._mm[entry.offset: entry.offset + entry.length]
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+        self._fp.close()
+
+
+class PhotoPackWriter:
+    """バリアントを追記していき、close() でインデックスを書き出す"""
+
+    def __init__(self, directory: str, widths: List[int]):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._widths = sorted(widths)
+        self._fp = open(os.path.join(directory, PACK_FILE), "wb")
+        self._entries: Dict[str, list] = {}
+        self._offset = 0
+
+    def add(self, ref: str, width: int, fmt: str, data: bytes) -> None:
+        etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+        self._fp.write(data)
+        self._entries[_entry_key(ref, width, fmt)] = [self._offset, len(data), etag]
+        self._offset += len(data)
+
+    def close(self) -> None:
+        self._fp.close()
+        with open(os.path.join(self.directory, INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "widths": self._widths, "entries": self._entries}, f)
@@ -0,0 +1,174 @@
+# place_cards.py
+#
+# 店舗カード：店ごとの 地址 / 推薦 / 特色 / 營業時間 を、繁體中文・日本語・英語で前もって作っておく。
+#   <インデックスの版>/place_cards.json   {place_id: {"src": 元データのハッシュ, "zh": {...}, "ja": {...}, "en": {...}}}
+# コーパスはクロールの間は変わらないので、取り込み時（add_reviews_to_faiss.py）に LLM でまとめて1回だけ作る。
+# 前の版のカードは、元データが変わっていない店ならそのまま引き継ぐ（新しい店・変わった店だけ生成）。
+# 検索時はカードを引くだけにして、LLM には店の選択と順位付けだけをさせる（ramen_qa.answer_ramen）。
+#
+#   python place_cards.py [インデックスのディレクトリ]   既存の版にカードだけ作る（既定は今の版）
+
+import os
+import re
+import sys
+import json
+import hashlib
+from typing import Dict, Iterable, Optional, Tuple
+
+CARDS_FILE = "place_cards.json"
+# zh は繁體中文（line_bot のロケールと同じキー）
+CARD_LANGS = ("zh", "ja", "en")
+CARD_FIELDS = ("地址", "推薦", "特色", "營業時間")
+PLACE_CARDS_MODEL = os.getenv("PLACE_CARDS_MODEL", "gpt-3.5-turbo")
+PLACE_CARDS_BATCH = int(os.getenv("PLACE_CARDS_BATCH", "5"))
+# 1店舗あたりプロンプトに入れるレビュー本文の上限（文字数）
+SOURCE_CHARS = 1500
+
+CARD_PROMPT = """\
+您是台北的餐廳導覽編輯。請根據以下每家店的資料，為每家店寫出繁體中文、日語、英語三種語言的店舗卡片。
+
+欄位：
+- 地址：店家地址（繁體中文保持原文，日語・英語請翻譯）
+- 推薦：推薦的餐點（一行，以頓號或逗號分隔）
+- 特色：店的特色（一到兩句，簡潔）
+- 營業時間：營業時間的簡短摘要
+
+請只輸出 JSON，不要加入其他文字。格式：
+{{"<place_id>": {{"zh": {{"地址": "", "推薦": "", "特色": "", "營業時間": ""}}, "ja": {{...}}, "en": {{...}}}}}}
+
+店家資料：
+{places}
+"""
+
+
+def collect_places(rows: Iterable[Tuple[str, dict]]) -> Dict[str, dict]:
+    """(page_content, metadata) を place_id ごとにまとめる（店名・住所・営業時間・本文）"""
+    places: Dict[str, dict] = {}
+    for text, md in rows:
+        md = md or {}
+        pid = md.get("place_id")
+        if not pid:
+            continue
+        place = places.setdefault(pid, {
+            "店名": md.get("title", ""),
+            "地址": md.get("address", ""),
+            "營業時間": "; ".join((md.get("opening_hours") or {}).get("weekday_text") or []),
+            "評論": "",
+        })
+        if len(place["評論"]) < SOURCE_CHARS:
+            place["評論"] = (place["評論"] + "\n" + (text or "")).strip()[:SOURCE_CHARS]
+    return places
+
+
+def source_hash(place: dict) -> str:
+    """元データが変わったか判定する用（変わっていなければ前の版のカードを使い回す）"""
+    raw = json.dumps(place, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def load_cards(index_dir: str) -> Dict[str, dict]:
+    """place_cards.json がなければ空（検索側は従来どおり LLM が書く）"""
+    try:
+        with open(os.path.join(index_dir, CARDS_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_cards(index_dir: str, cards: Dict[str, dict]) -> str:
+    path = os.path.join(index_dir, CARDS_FILE)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cards, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+def card_fields(cards: Dict[str, dict], place_id: Optional[str], lang: str) -> Optional[Dict[str, str]]:
+    """place_id の lang のカード（欄位 → 値）。なければ None"""
+    card = cards.get(place_id) if place_id else None
+    fields = (card or {}).get(lang if lang in CARD_LANGS else "zh")
+    return {k: fields[k] for k in CARD_FIELDS if fields.get(k)} if fields else None
+
+
+def _valid(card) -> bool:
+    return isinstance(card, dict) and all(
+        isinstance(card.get(lang), dict) and any(card[lang].get(k) for k in CARD_FIELDS) for lang in CARD_LANGS
+    )
+
+
+def _generate(llm, batch: Dict[str, dict]) -> Dict[str, dict]:
+    """数店舗分を1回の LLM 呼び出しで作る。形の崩れた店は捨てる（検索時は LLM 生成に戻る）"""
+    prompt = CARD_PROMPT.format(places=json.dumps(batch, ensure_ascii=False, indent=1))
+    raw = llm.invoke(prompt).content
+    match = re.search(r"\{.*\}", raw, re.S)
+    try:
+        out = json.loads(match.group(0)) if match else {}
+    except ValueError:
+        out = {}
+    cards = {}
+    for pid, card in out.items():
+        if pid in batch and _valid(card):
+            cards[pid] = {lang: {k: str(card[lang].get(k) or "").strip() for k in CARD_FIELDS} for lang in CARD_LANGS}
+    return cards
+
+
+def build_cards(places: Dict[str, dict], llm, previous: Optional[Dict[str, dict]] = None,
+                batch_size: int = PLACE_CARDS_BATCH) -> Dict[str, dict]:
+    """全店舗のカード。元データが同じ店は previous から引き継ぐ"""
+    previous = previous or {}
+    cards: Dict[str, dict] = {}
+    todo: Dict[str, dict] = {}
+    for pid, place in places.items():
+        src = source_hash(place)
+        if previous.get(pid, {}).get("src") == src:
+            cards[pid] = previous[pid]
+        else:
+            todo[pid] = place
+
+    print(f"🪪 place cards: {len(cards)} reused, {len(todo)} to generate")
+    pids = list(todo)
+    for i in range(0, len(pids), batch_size):
+        batch = {pid: todo[pid] for pid in pids[i:i + batch_size]}
+        try:
+            generated = _generate(llm, batch)
+        except Exception as e:
+            print(f"⚠️ place cards batch {i // batch_size + 1} failed: {e}")
+            continue
+        for pid, card in generated.items():
+            cards[pid] = {"src": source_hash(todo[pid]), **card}
+        missing = len(batch) - len(generated)
+        if missing:
+            print(f"⚠️ place cards batch {i // batch_size + 1}: {missing} places skipped")
+    return cards
+
+
+def make_llm():
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(model=PLACE_CARDS_MODEL, temperature=0)
+
+
+def main():
+    from compact_docstore import CompactDocstore, compact_path, exists as compact_exists
+    from index_versions import resolve_index_path
+
+    index_dir = sys.argv[1] if len(sys.argv) > 1 else resolve_index_path()[0]
+    if compact_exists(index_dir):
+        store = CompactDocstore(compact_path(index_dir))
+        rows = ((store.text(row, "page_content"), store.metadata(row)) for row in range(len(store)))
+    else:
+        from langchain_community.vectorstores.faiss import FAISS
+        from embeddings_backend import make_embeddings
+
+        vs = FAISS.load_local(index_dir, make_embeddings(), allow_dangerous_deserialization=True)
+        docs = (vs.docstore.search(vs.index_to_docstore_id[row]) for row in range(vs.index.ntotal))
+        rows = ((d.page_content, d.metadata) for d in docs)
+
+    cards = build_cards(collect_places(rows), make_llm(), previous=load_cards(index_dir))
+    print(f"✅ {len(cards)} place cards saved at '{write_cards(index_dir, cards)}'.")
+    print("   検索サーバは POST /admin/reload-index?force=true で読み直してください。")
+
+
+if __name__ == "__main__":
+    main()
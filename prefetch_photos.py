@@ -0,0 +1,128 @@
+# prefetch_photos.py
+#
+# 各店舗のヒーロー写真を1回だけダウンロードし、build_ramen_flex が使う 20:13 に
+# 切り出した JPEG / WebP を複数幅で photo_pack/ にまとめる。
+# 定常運用では /photo はこのパックから返すので、ネットワークに出ない。
+
+import io
+import os
+import json
+import shutil
+import time
+
+import requests
+from PIL import Image
+
+from photo_pack import PhotoPack, PhotoPackWriter
+
+API_KEY = os.getenv("GOOGLE_PLACES_API_KEY")
+if not API_KEY:
+    raise RuntimeError("Please set GOOGLE_PLACES_API_KEY environment variable")
+
+JSON_FILE = "ramen_google_reviews.json"
+PACK_DIR = os.getenv("PHOTO_PACK_DIR", "photo_pack")
+
+SOURCE_MAXWIDTH = 1600       # 元画像の取得幅
+WIDTHS = [480, 960]          # 書き出す幅
+ASPECT = (20, 13)            # Flex hero の aspectRatio
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+
+def crop_to_aspect(img: Image.Image, aspect=ASPECT) -> Image.Image:
+    """中央基準で aspect の比率に切り出す"""
+    w, h = img.size
+    target = aspect[0] / aspect[1]
+    if w / h > target:
+        new_w = int(h * target)
+        left = (w - new_w) // 2
+        return img.crop((left, 0, left + new_w, h))
+    new_h = int(w / target)
+    top = (h - new_h) // 2
+    return img.crop((0, top, w, top + new_h))
+
+
+def render_variants(raw: bytes):
+    """(width, format, bytes) を返す"""
+    img = Image.open(io.BytesIO(raw)).convert("RGB")
+    img = crop_to_aspect(img)
+    for width in WIDTHS:
+        height = round(width * ASPECT[1] / ASPECT[0])
+        resized = img.resize((width, height), Image.LANCZOS) if img.width > width else img
+        buf = io.BytesIO()
+        resized.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        yield width, "jpeg", buf.getvalue()
+        buf = io.BytesIO()
+        resized.save(buf, "WEBP", quality=WEBP_QUALITY, method=6)
+        yield width, "webp", buf.getvalue()
+
+
+def fetch_photo(ref: str) -> bytes:
+    r = requests.get(
+        "https://maps.googleapis.com/maps/api/place/photo",
+        params={"maxwidth": SOURCE_MAXWIDTH, "photo_reference": ref, "key": API_KEY},
+        timeout=30,
+    )
+    ctype = r.headers.get("Content-Type", "")
+    if r.status_code != 200 or not ctype.startswith("image/"):
+        raise RuntimeError(f"status={r.status_code} ctype='{ctype}'")
+    return r.content
+
+
+def main():
+    with open(JSON_FILE, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    refs = []
+    for e in entries:
+        ref = (e.get("metadata") or {}).get("photo_reference")
+        if ref and ref not in refs:
+            refs.append(ref)
+
+    # 既存パックがあれば再利用（同じ写真は取り直さない）
+    old = None
+    if os.path.exists(os.path.join(PACK_DIR, "photos.idx.json")):
+        old = PhotoPack(PACK_DIR)
+        if old.widths != sorted(WIDTHS):
+            old.close()
+            old = None
+
+    tmp_dir = PACK_DIR + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    writer = PhotoPackWriter(tmp_dir, WIDTHS)
+
+    fetched = reused = failed = 0
+    for ref in refs:
+        if old is not None and old.lookup(ref, WIDTHS[0]):
+            for width in WIDTHS:
+                for fmt in ("jpeg", "webp"):
+                    e = old.lookup(ref, width, fmt)
+                    if e:
+                        writer.add(ref, width, fmt, old.read(e))
+            reused += 1
+            continue
+
+        try:
+            raw = fetch_photo(ref)
+            for width, fmt, data in render_variants(raw):
+                writer.add(ref, width, fmt, data)
+            fetched += 1
+            print(f"✅ {ref[:24]}… ({len(raw) // 1024} KB)")
+        except Exception as e:
+            failed += 1
+            print(f"⚠️ {ref[:24]}… skipped: {e}")
+        time.sleep(0.1)  # レート制限回避
+
+    writer.close()
+    if old is not None:
+        old.close()
+
+    # 差し替え（配信側は次回ロード時に新しいパックを開く）
+    if os.path.isdir(PACK_DIR):
+        shutil.rmtree(PACK_DIR)
+    os.replace(tmp_dir, PACK_DIR)
+    print(f"\n✅ photo pack saved at '{PACK_DIR}': fetched={fetched} reused={reused} failed={failed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,86 @@
 #ramen_qa.py
+#
+# import 時は設定を読むだけ。LLM・埋め込み・FAISS と各インデックスは _Resources にまとめ、
+# 最初に使うとき（または warmup()）に1回だけ作る。失敗したら次の呼び出しで作り直す。
+# インデックスの新しい版が公開されたら reload_index() で横に読み込み、参照ごと差し替える。
 
 import os
 import re
-from typing import Optional, Dict, Any, List
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.chains import RetrievalQA
-from langchain_community.vectorstores.faiss import FAISS
-from langchain.prompts import PromptTemplate
-from langdetect import detect
-import googlemaps
-from geopy.distance import geodesic
+import json
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Dict, Any, List
+import numpy as np
+
+from geo_index import GeoIndex
+from lexical_index import LexicalIndex
+from title_index import TitleIndex
+from filter_engine import MetadataColumns, build_mask, is_time_dependent
+from opening_hours import now_taipei, tonight_taipei, slot_of
+from answer_cache import SemanticAnswerCache, location_cell
+from index_versions import resolve_index_path
+from translation_cache import TranslationCache
+from place_cards import card_fields, load_cards
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores.faiss import FAISS
+    from request_context import RequestContext
 
 # ───────────────────────────────────────
-# 環境変数と初期化
+# 環境変数
 # ───────────────────────────────────────
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_PLACES_API_KEY")
-if not OPENAI_API_KEY or not GOOGLE_MAPS_API_KEY:
-    raise RuntimeError("APIキーが設定されていません。")
 
-_embedding = OpenAIEmbeddings()
-_llm = ChatOpenAI(model="gpt-3.5-turbo")
-_INDEX_PATH = "faiss_index"
-_gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY)
+# クエリ埋め込みは LRU + SQLite でキャッシュ（同じ言い回しの再計算を避ける）
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
 
-try:
-    _vectorstore = FAISS.load_local(_INDEX_PATH, _embedding, allow_dangerous_deserialization=True)
-except Exception:
-    _vectorstore = None
+# FAISS インデックスを mmap で開く（serve.py の複数ワーカーや複数プロセスでページを共有）
+FAISS_MMAP = os.getenv("FAISS_MMAP", "0") == "1"
 
-_qa_chain: Optional[RetrievalQA] = None
+# filter ごとの検索器プールの上限（正規化した filter → _RankedRetriever）
+RETRIEVER_POOL_MAX = int(os.getenv("RETRIEVER_POOL_MAX", "64"))
+
+# 意味的に近い質問の回答キャッシュ（LLM 呼び出しを省く）
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+_answer_cache = SemanticAnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ttl_sec=float(os.getenv("ANSWER_CACHE_TTL_SEC", str(6 * 3600))),
+    max_per_bucket=int(os.getenv("ANSWER_CACHE_MAX_PER_BUCKET", "256")),
+    max_buckets=int(os.getenv("ANSWER_CACHE_MAX_BUCKETS", "4096")),
+)
+
+# 店舗ごとの固定的な項目の翻訳キャッシュ（(place_id, 項目, 言語) → 訳文）
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", "translation_cache.sqlite3")
+_translation_cache = TranslationCache(
+    TRANSLATION_CACHE_PATH or None,
+    ttl_sec=float(os.getenv("TRANSLATION_CACHE_TTL_SEC", str(30 * 86400))),
+)
+
+# ベクトル検索の件数と、そのうち距離順に並べ替えてプロンプトへ入れる件数
+# （店名・駅名の一致は BM25 側で拾えるので、ベクトル側は少なめで足りる）
+SEARCH_K = int(os.getenv("SEARCH_K", "8"))
+CONTEXT_K = 5
+# BM25 から拾う件数
+LEXICAL_K = int(os.getenv("LEXICAL_K", "10"))
+# 座標があるとき、ベクトル検索とは別に半径内から拾う件数と半径
+GEO_RADIUS_M = float(os.getenv("GEO_RADIUS_M", "1500"))
+GEO_K = int(os.getenv("GEO_K", "20"))
+RRF_K = 60
+# 1店舗が複数チャンクに分かれているので、チャンクは多めに取ってから店舗単位にまとめる
+CHUNK_OVERSAMPLE = int(os.getenv("CHUNK_OVERSAMPLE", "3"))
+# 店舗のスコア = そのチャンクたちの max / mean / top2（上位2件の和）
+PLACE_SCORE_AGG = os.getenv("PLACE_SCORE_AGG", "max")
+# シャード分割したインデックスで、座標からこの半径内にかかるシャードだけを検索する
+SHARD_SEARCH_RADIUS_M = float(os.getenv("SHARD_SEARCH_RADIUS_M", "3000"))
+# filter 後の候補がこの件数以下なら、ベクトルを取り出して総当たりで測る
+PREFILTER_BRUTE_FORCE_MAX = int(os.getenv("PREFILTER_BRUTE_FORCE_MAX", "4096"))
 
 # ───────────────────────────────────────
 # カスタムプロンプト
 # ───────────────────────────────────────
-QA_PROMPT = PromptTemplate(
-    template="""\
+QA_TEMPLATE = """\
 您是台北的餐廳導覽 AI，請根據以下參考資料，對提問做出簡潔且具體的回答。
 **請優先考慮「問題中提及的地點」與「捷運站」欄位最接近的餐廳，最多給出3家。**
 可以包含任何類型的餐飲（中式、西式、日本料理、甜點、咖啡廳等）。
@@ -56,9 +101,25 @@ QA_PROMPT = PromptTemplate(
 推薦：  
 特色：
 營業時間:
-""",
-    input_variables=["context", "question"]
-)
+"""
+
+# 全候補に店舗カード（place_cards.json）があるときは、店の選択と順位付けだけをさせる
+SELECT_TEMPLATE = """\
+您是台北的餐廳導覽 AI，請根據以下參考資料，選出最符合提問的餐廳，依推薦順序排列。
+**請優先考慮「問題中提及的地點」與「捷運站」欄位最接近的餐廳，最多給出3家。**
+
+請只輸出店名，每家店之間以 `---` 分隔，並不要加入其他說明文字或語句。
+
+問題：
+{question}
+
+參考資料：
+{context}
+
+輸出格式（最多三家）：
+
+店名：
+"""
 
 # QA_PROMPT = PromptTemplate(
 #     template="""\
@@ -85,6 +146,184 @@ QA_PROMPT = PromptTemplate(
 #     input_variables=["context", "question"]
 # )
 
+# ───────────────────────────────────────
+# 行番号（FAISS の内部 id）ベースのヘルパー
+# ───────────────────────────────────────
+def _doc_for_row(vectorstore: "FAISS", row: int):
+    return vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(row)])
+
+def _row_metadatas(vectorstore: "FAISS"):
+    for row in range(vectorstore.index.ntotal):
+        yield _doc_for_row(vectorstore, row).metadata
+
+def _row_texts(vectorstore: "FAISS", field: str):
+    """行番号順の page_content / title（compact docstore なら metadata を読まずに取り出す）"""
+    from compact_docstore import CompactDocstore
+
+    if isinstance(vectorstore.docstore, CompactDocstore):
+        return vectorstore.docstore.texts(field)
+    docs = (_doc_for_row(vectorstore, r) for r in range(vectorstore.index.ntotal))
+    return (d.page_content if field == "page_content" else d.metadata.get(field) or "" for d in docs)
+
+def _build_columns(vectorstore: "FAISS") -> MetadataColumns:
+    from compact_docstore import CompactDocstore
+
+    if isinstance(vectorstore.docstore, CompactDocstore):
+        return MetadataColumns.from_compact(vectorstore.docstore)
+    return MetadataColumns(list(_row_metadatas(vectorstore)))
+
+# ───────────────────────────────────────
+# 重いリソース一式（遅延初期化）
+# ───────────────────────────────────────
+class _Resources:
+    """LLM・埋め込み・FAISS と、その上に作る検索用インデックス一式"""
+
+    def __init__(self, index_path: str, version: Optional[str] = None):
+        self.index_path = index_path
+        self.version = version
+        if not OPENAI_API_KEY or not GOOGLE_MAPS_API_KEY:
+            raise RuntimeError("APIキーが設定されていません。")
+        if not os.path.exists(os.path.join(index_path, "index.faiss")):
+            raise RuntimeError(f"FAISS index not found at '{index_path}'。")
+
+        # 重いライブラリはここで初めて読み込む（import を速くするため）
+        import googlemaps
+        from langchain_openai import ChatOpenAI
+        from langchain.chains.question_answering import load_qa_chain
+        from langchain.prompts import PromptTemplate
+        from langchain_community.vectorstores.faiss import FAISS
+        from compact_docstore import exists as compact_exists, load_vectorstore
+        from embedding_cache import CachedEmbeddings
+        from embeddings_backend import check_fingerprint, fingerprint, fingerprint_id, make_embeddings
+        import faiss
+        from faiss_tuning import apply_search_params, read_flags, read_report
+        from shard_index import ShardedIndex, exists as shards_exist
+
+        # 埋め込みは EMBEDDING_BACKEND（openai / local）。キャッシュのキーはモデルごとに分ける
+        underlying = make_embeddings()
+        self.embedding = CachedEmbeddings(
+            underlying, path=EMBEDDING_CACHE_PATH or None, max_entries=EMBEDDING_CACHE_SIZE,
+            model_name=fingerprint_id(fingerprint(underlying)),
+        )
+        self.llm = ChatOpenAI(model="gpt-3.5-turbo")
+        self.gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY)
+        # 検索済みの Document をそのまま QA_TEMPLATE に詰める stuff チェーン（retriever は持たない）
+        self.qa_chain = load_qa_chain(
+            self.llm, chain_type="stuff",
+            prompt=PromptTemplate(template=QA_TEMPLATE, input_variables=["context", "question"]),
+        )
+        self.select_chain = load_qa_chain(
+            self.llm, chain_type="stuff",
+            prompt=PromptTemplate(template=SELECT_TEMPLATE, input_variables=["context", "question"]),
+        )
+
+        # flat / HNSW / IVF / IVF-PQ どれで保存されていてもそのまま読める。
+        # シャード（shards/shards.json）があれば index.faiss の代わりにそちらを使う
+        io_flags = read_flags(FAISS_MMAP)
+        sharded = ShardedIndex(index_path, io_flags) if shards_exist(index_path) else None
+        if compact_exists(index_path):
+            # compact docstore があれば pickle を読まずに mmap で開く
+            self.vectorstore = load_vectorstore(index_path, self.embedding, index=sharded, io_flags=io_flags)
+        else:
+            self.vectorstore = FAISS.load_local(index_path, self.embedding, allow_dangerous_deserialization=True)
+            if sharded is not None:
+                self.vectorstore.index = sharded
+            elif io_flags:
+                self.vectorstore.index = faiss.read_index(os.path.join(index_path, "index.faiss"), io_flags)
+        # インデックスを作ったモデルと違えば、ここで止める（黙って的外れな検索をしない）
+        check_fingerprint(index_path, underlying, self.vectorstore.index.d)
+        # 検索パラメータ：build_report.json の値を既定に、環境変数で上書き
+        search_params = read_report(index_path).get("search_params", {})
+        for index in (sharded.shards if sharded is not None else [self.vectorstore.index]):
+            apply_search_params(
+                index,
+                ef_search=os.getenv("FAISS_HNSW_EF_SEARCH") or search_params.get("hnsw_ef_search"),
+                nprobe=os.getenv("FAISS_IVF_NPROBE") or search_params.get("ivf_nprobe"),
+            )
+
+        # metadata の列指向配列（filter 評価用）と、全店舗の緯度経度（距離計算・半径検索用）
+        self.columns = _build_columns(self.vectorstore)
+        self.geo_index = GeoIndex(self.columns.lat, self.columns.lng)
+        # 店名・住所・駅名の n-gram BM25（固有名詞の完全一致に強い）
+        self.lexical_index = LexicalIndex.from_page_contents(_row_texts(self.vectorstore, "page_content"))
+        # LLM が書いた店名 → 店舗（表記ゆれ・支店名を吸収して全店舗から引く）
+        self.title_index = TitleIndex(_row_texts(self.vectorstore, "title"), self.columns.place_code)
+        # 取り込み時に作った多言語の店舗カード（place_id → 言語 → 欄位）。なければ空
+        self.place_cards = load_cards(index_path)
+
+        self._retriever_pool: "OrderedDict[str, _RankedRetriever]" = OrderedDict()
+        self._retriever_pool_lock = threading.Lock()
+
+    def retriever(self, filters: Optional[Dict[str, Any]]) -> "_RankedRetriever":
+        """filter ごとの検索器（マスクのコンパイルを使い回す）"""
+        key = _normalize_filters(filters)
+        with self._retriever_pool_lock:
+            retriever = self._retriever_pool.get(key)
+            if retriever is None:
+                retriever = _RankedRetriever(
+                    self.vectorstore, self.columns, self.geo_index, self.lexical_index, filters
+                )
+                self._retriever_pool[key] = retriever
+                if len(self._retriever_pool) > RETRIEVER_POOL_MAX:
+                    self._retriever_pool.popitem(last=False)
+            else:
+                self._retriever_pool.move_to_end(key)
+        return retriever
+
+_resources: Optional[_Resources] = None
+_resources_lock = threading.Lock()
+# 差し替え用の読み込みは同時に1本だけ
+_reload_lock = threading.Lock()
+_init_error: Optional[str] = None
+
+def _get_resources() -> _Resources:
+    """今の版のリソース。リクエストは最初に1回だけ呼び、途中で差し替わっても同じものを使い続ける"""
+    global _resources, _init_error
+    if _resources is None:
+        with _resources_lock:
+            if _resources is None:
+                try:
+                    _resources = _Resources(*resolve_index_path())
+                    _init_error = None
+                except Exception as e:
+                    _init_error = f"{type(e).__name__}: {e}"
+                    raise
+    return _resources
+
+def reload_index(force: bool = False) -> dict:
+    """CURRENT が指す版が変わっていれば、新しい版を横で読み込んでから参照を差し替える。
+    読み込み中も古い版で応答し続け、古い版は使用中のリクエストが終われば解放される"""
+    global _resources
+    if _resources is None:
+        _get_resources()
+        return {"reloaded": True, "version": _resources.version}
+
+    with _reload_lock:
+        path, version = resolve_index_path()
+        old = _resources
+        if not force and (old.index_path, old.version) == (path, version):
+            return {"reloaded": False, "version": version}
+        new = _Resources(path, version)  # 失敗したら例外（古い版のまま）
+        with _resources_lock:
+            _resources = new
+        # 古い版の検索結果から作った回答は捨てる
+        _answer_cache.clear()
+    return {"reloaded": True, "version": version, "previous": old.version}
+
+def index_version() -> Optional[str]:
+    return _resources.version if _resources is not None else None
+
+def warmup() -> None:
+    """重いリソースを先に作っておく（起動直後にバックグラウンドで呼ぶ）。失敗時は例外"""
+    _get_resources()
+
+def is_ready() -> bool:
+    return _resources is not None
+
+def init_error() -> Optional[str]:
+    """直近の初期化失敗の内容（成功していれば None）"""
+    return _init_error
+
 # ───────────────────────────────────────
 # ヘルパー：地名→座標
 # ───────────────────────────────────────
@@ -94,7 +333,7 @@ def extract_address(text: str) -> Optional[str]:
 
 def geocode_location(address: str) -> Optional[tuple]:
     try:
-        geocode = _gmaps.geocode(address)
+        geocode = _get_resources().gmaps.geocode(address)
         if geocode and len(geocode) > 0:
             loc = geocode[0]["geometry"]["location"]
             return (loc["lat"], loc["lng"])
@@ -103,52 +342,251 @@ def geocode_location(address: str) -> Optional[tuple]:
     return None
 
 # ───────────────────────────────────────
-# QA チェーン初期化
+# 検索（1回だけ）＋距離順の並べ替え
 # ───────────────────────────────────────
-def _init_qa_chain(filters: Optional[Dict[str, Any]] = None):
-    global _qa_chain
-    if _qa_chain is None or filters is not None:
-        if _vectorstore is None:
-            raise RuntimeError(f"FAISS index not found at '{_INDEX_PATH}'。")
-        retriever = _vectorstore.as_retriever(search_kwargs={"filter": filters or {}, "k": 5})
-        _qa_chain = RetrievalQA.from_chain_type(
-            llm=_llm,
-            retriever=retriever,
-            chain_type="stuff",
-            chain_type_kwargs={"prompt": QA_PROMPT}
-        )
+def _split_filters(metadata_filters: Optional[Dict[str, Any]]):
+    """location は距離ソートの中心として使う。radius_m があるときだけ半径での絞り込みにもする
+    （半径なしの座標を絞り込みに使っても意味がないため）"""
+    if not metadata_filters:
+        return None, None
+    rest = {k: v for k, v in metadata_filters.items() if k != "location"}
+    loc = metadata_filters.get("location") or {}
+    center = (loc["lat"], loc["lng"]) if loc.get("lat") is not None and loc.get("lng") is not None else None
+    if center and loc.get("radius_m") is not None:
+        rest["location"] = loc
+    return center, (rest or None)
+
+def _normalize_filters(filters: Optional[Dict[str, Any]]) -> str:
+    if not filters:
+        return ""
+    return json.dumps(filters, sort_keys=True, ensure_ascii=False, default=str)
+
+def _vector_distances(index, vecs: np.ndarray, query_vector) -> np.ndarray:
+    """小さいほど近い値（L2 は二乗距離、内積インデックスは -内積）"""
+    import faiss
+
+    q = np.asarray(query_vector, dtype=np.float32)
+    if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+        return -(vecs @ q)
+    return ((vecs - q) ** 2).sum(axis=1)
+
+def _vector_search(vectorstore: "FAISS", query_vector: List[float], k: int,
+                   mask: Optional[np.ndarray] = None, query_coord: Optional[tuple] = None) -> np.ndarray:
+    """ベクトルの近い順に行番号を返す。mask があればスコア計算の前に候補を絞る"""
+    from faiss_tuning import search_with_mask
+    from shard_index import ShardedIndex
+
+    index = vectorstore.index
+    q = np.asarray([query_vector], dtype=np.float32)
+    if isinstance(index, ShardedIndex):
+        # 座標があれば範囲内のシャードだけ（並列に検索してマージ）。
+        # 範囲内にシャードがない（台北から離れた座標など）ときは全シャードを検索する
+        shards = (index.select(*query_coord, SHARD_SEARCH_RADIUS_M) or None) if query_coord else None
+        if mask is not None and len(np.flatnonzero(mask)) <= PREFILTER_BRUTE_FORCE_MAX:
+            cand = np.flatnonzero(mask)
+            d = _vector_distances(index, index.reconstruct_batch(cand), query_vector)
+            return cand[np.argsort(d, kind="stable")[:k]]
+        _, ids = index.search(q, k, mask, shards)
+        ids = ids[0][ids[0] >= 0]
+        if not len(ids) and shards is not None:
+            # 範囲内のシャードに条件に合う店がなければ、全シャードから意味の近い店を返す
+            _, ids = index.search(q, k, mask)
+            ids = ids[0][ids[0] >= 0]
+        return ids
+    if mask is None:
+        _, ids = index.search(q, min(k, index.ntotal))
+        return ids[0][ids[0] >= 0]
+
+    cand = np.flatnonzero(mask)
+    if not len(cand):
+        return cand
+    if len(cand) <= PREFILTER_BRUTE_FORCE_MAX:
+        try:
+            d = _vector_distances(index, index.reconstruct_batch(cand), query_vector)
+            top = np.argsort(d, kind="stable")[:k]
+            return cand[top]
+        except RuntimeError:
+            pass  # 再構成できない索引は IDSelector で
+    _, ids = search_with_mask(index, q, min(k, len(cand)), mask)
+    return ids[0][ids[0] >= 0]
+
+def _semantic_order(vectorstore: "FAISS", rows: np.ndarray, query_vector: List[float]) -> np.ndarray:
+    """候補行をクエリベクトルに近い順に並べる（再構成できない索引なら元の順）"""
+    try:
+        vecs = vectorstore.index.reconstruct_batch(rows)
+    except Exception:
+        return rows
+    d = _vector_distances(vectorstore.index, vecs, query_vector)
+    return rows[np.argsort(d, kind="stable")]
+
+def _rrf(ranked_lists: List[np.ndarray], k: int = RRF_K):
+    """Reciprocal Rank Fusion：各リストの順位 r に 1/(k + r) を足して並べ直す。(行番号, スコア) を返す"""
+    rows = np.concatenate(ranked_lists).astype(np.int64)
+    scores = np.concatenate([1.0 / (k + np.arange(1, len(l) + 1)) for l in ranked_lists])
+    uniq, inv = np.unique(rows, return_inverse=True)
+    total = np.bincount(inv, weights=scores)
+    order = np.argsort(-total, kind="stable")
+    return uniq[order], total[order]
+
+def _collapse_by_place(rows: np.ndarray, scores: np.ndarray, place_codes: np.ndarray,
+                       agg: str = PLACE_SCORE_AGG) -> np.ndarray:
+    """チャンクを店舗ごとにまとめ、店舗スコア順に「各店舗の最良チャンク」の行番号を返す"""
+    if not len(rows):
+        return rows
+    codes = place_codes[rows]
+    order = np.lexsort((-scores, codes))  # 店舗ごと、店舗内はスコア降順
+    codes, rows, scores = codes[order], rows[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    counts = np.diff(np.r_[starts, len(rows)])
+
+    if agg == "mean":
+        place_scores = np.add.reduceat(scores, starts) / counts
+    elif agg == "top2":
+        second = np.where(counts > 1, scores[np.minimum(starts + 1, len(scores) - 1)], 0.0)
+        place_scores = scores[starts] + second
+    else:
+        place_scores = scores[starts]
+
+    best = rows[starts]
+    return best[np.argsort(-place_scores, kind="stable")]
+
+class _RankedRetriever:
+    """filter を固定した検索器。リクエストごとの値（クエリ・座標）は引数で受け取り、
+    自身は状態を持たないのでスレッド間で共有できる"""
+
+    def __init__(self, vectorstore: "FAISS", columns: MetadataColumns, geo_index: Optional[GeoIndex],
+                 lexical_index: Optional[LexicalIndex], filters: Optional[Dict[str, Any]]):
+        self._vectorstore = vectorstore
+        self._geo_index = geo_index
+        self._lexical_index = lexical_index
+        self._columns = columns
+        # filter は作成時に1回だけマスクへコンパイル（プールで使い回す）。
+        # ただし営業時間（"now"）を含むものはリクエストごとに評価する
+        self._filters = json.loads(_normalize_filters(filters)) if filters else None
+        self._dynamic = is_time_dependent(self._filters)
+        self._static_mask = None if self._dynamic else build_mask(self._filters, columns)
+
+    def _request_mask(self) -> Optional[np.ndarray]:
+        return build_mask(self._filters, self._columns) if self._dynamic else self._static_mask
+
+    def retrieve(self, query_text: str, query_vector: List[float], query_coord: Optional[tuple],
+                 open_boost_at=None) -> list:
+        mask = self._request_mask()
+
+        def apply_mask(rows: np.ndarray) -> np.ndarray:
+            return rows if mask is None else rows[mask[rows]]
+
+        # FAISS検索（SEARCH_K 店舗分のチャンク）。埋め込みは呼び出し側で1回だけ計算済み
+        rows = _vector_search(self._vectorstore, query_vector, SEARCH_K * CHUNK_OVERSAMPLE, mask, query_coord)
+        ranked = [rows]
+
+        # 店名・駅名の BM25 ヒット
+        lexical = np.empty(0, dtype=np.int64)
+        if self._lexical_index is not None:
+            lexical, _ = self._lexical_index.search(query_text, LEXICAL_K * CHUNK_OVERSAMPLE)
+            lexical = apply_mask(lexical)
+            if len(lexical):
+                ranked.append(lexical)
+
+        # 座標があれば、半径内の近い店も候補に足す
+        near = np.empty(0, dtype=np.int64)
+        if query_coord and self._geo_index is not None:
+            lat, lng = query_coord
+            near, _ = self._geo_index.within(lat, lng, GEO_RADIUS_M)
+            near = apply_mask(near[~np.isin(near, rows)][:GEO_K * CHUNK_OVERSAMPLE])
+
+        if len(ranked) > 1 or len(near) or query_coord or open_boost_at is not None:
+            # 「意味の近さ」「BM25」「距離」の各順位を RRF で融合
+            cand = np.concatenate([rows, lexical, near]).astype(np.int64)
+            _, first = np.unique(cand, return_index=True)
+            cand = cand[np.sort(first)]  # 重複を除きつつベクトル検索の順を保つ
+            ranked = ranked[1:] + [_semantic_order(self._vectorstore, cand, query_vector)]
+        if query_coord and self._geo_index is not None:
+            ranked.append(cand[np.argsort(self._geo_index.distances(lat, lng, cand), kind="stable")])
+        if open_boost_at is not None:
+            # 「営業中」を聞かれたら、その時刻に開いている店を前に寄せる
+            is_open = self._columns.hours.open_at(open_boost_at)[cand]
+            ranked.append(cand[np.argsort(~is_open, kind="stable")])
+        rows, scores = _rrf(ranked)
+
+        # 同じ店のチャンクが上位を占めないよう、店舗単位にまとめる
+        rows = _collapse_by_place(rows, scores, self._columns.place_code)[:SEARCH_K]
+        return [_doc_for_row(self._vectorstore, r) for r in rows]
+
+_OPEN_NOW_WORDS = re.compile(r"營業中|营业中|現在|现在|開著|开着|営業中|今開|open now|right now", re.IGNORECASE)
+_LATE_NIGHT_WORDS = re.compile(r"深夜|宵夜|消夜|半夜|夜宵|late night|open late|夜遅く", re.IGNORECASE)
+
+def _hours_intent(text: str):
+    """営業時間を気にしている質問なら、その基準時刻（台北時間）を返す"""
+    if _LATE_NIGHT_WORDS.search(text):
+        return tonight_taipei()
+    if _OPEN_NOW_WORDS.search(text):
+        return now_taipei()
+    return None
+
+def _resolve_store(res: _Resources, store_name: str, docs: list):
+    """店名に対応する店舗の Document。検索結果の店を優先し、なければ全店舗から探す"""
+    among = {c for c in (res.columns.place_code_of(d.metadata) for d in docs) if c is not None}
+    row = res.title_index.resolve(store_name, among) if among else None
+    if row is None:
+        row = res.title_index.resolve(store_name)
+    return _doc_for_row(res.vectorstore, row) if row is not None else None
 
 # ───────────────────────────────────────
 # QA 実行
 # ───────────────────────────────────────
-def answer_ramen(query: str, metadata_filters: Optional[Dict[str, Any]] = None) -> List[dict]:
-    from langchain.docstore.document import Document
-
-    src_lang = detect(query)
-    zh_query = query if src_lang.startswith("zh") else _translate(query, 'zh')
-
-    # 地名 → 座標取得（任意：実装済みなら使われます）
-    address = extract_address(query)
-    query_coord = geocode_location(address) if address else None
-
-    # FAISS検索（10件）
-    docs = _vectorstore.similarity_search(zh_query, k=10)
-
-    # 距離補正：近い順に並び替え（query_coord が取れたときだけ）
-    if query_coord:
-        def dist(doc):
-            loc = doc.metadata.get("location")
-            if loc:
-                return geodesic(query_coord, (loc["lat"], loc["lng"])).meters
-            return float("inf")
-        docs.sort(key=dist)
-
-    # QA 実行
-    _init_qa_chain(filters=metadata_filters)
-    raw = _qa_chain.invoke({"query": zh_query}).get("result", "")
+def answer_ramen(query: str, metadata_filters: Optional[Dict[str, Any]] = None,
+                 context: Optional["RequestContext"] = None) -> List[dict]:
+    """context（line_bot で1回だけ作った解析結果）があれば、言語判定・翻訳・ジオコードはやり直さない"""
+    # 初期化がまだなら、ここで1回だけ（通常は起動時の warmup() で済んでいる）
+    res = _get_resources()
+
+    filter_center, filters = _split_filters(metadata_filters)
+    if context is not None:
+        src_lang, zh_query = context.locale, context.zh_query
+        query_coord = context.coord or filter_center
+    else:
+        from langdetect import detect
+
+        src_lang = detect(query)
+        zh_query = query if src_lang.startswith("zh") else _translate(query, 'zh')
+        # 地名 → 座標取得（任意：実装済みなら使われます）。取れなければ呼び出し側の座標
+        address = extract_address(query)
+        query_coord = (geocode_location(address) if address else None) or filter_center
+
+    # 埋め込みは1回だけ（回答キャッシュの照合と FAISS 検索で共用）
+    if context is not None and context.query_vector is not None:
+        query_vector = context.query_vector
+    else:
+        query_vector = res.embedding.embed_query(zh_query)
+    # 営業時間が絡む質問は時刻で答えが変わるので、1時間単位でキャッシュを分ける
+    open_boost_at = _hours_intent(f"{query}\n{zh_query}")
+    time_bucket = slot_of(now_taipei()) // 4 if (open_boost_at or is_time_dependent(filters)) else None
+    cache_key = (src_lang, location_cell(query_coord), _normalize_filters(filters), time_bucket)
+    if ANSWER_CACHE_ENABLED:
+        cached = _answer_cache.lookup(query_vector, cache_key)
+        if cached is not None:
+            return cached
+
+    # 検索は1回だけ。距離と意味の近さで並べた上位をそのまま LLM に渡す
+    # BM25 は原文と中国語訳の両方で引く（簡体字訳だと繁体字の店名に当たらないため）
+    docs = res.retriever(filters).retrieve(
+        f"{query}\n{zh_query}", query_vector, query_coord, open_boost_at=open_boost_at
+    )
+
+    # QA 実行。候補が全部カード持ちなら LLM は店を選んで並べるだけ（本文はカードから）
+    card_lang = "zh" if src_lang.startswith("zh") else src_lang
+    select_only = bool(res.place_cards) and all(
+        d.metadata.get("place_id") in res.place_cards for d in docs[:CONTEXT_K]
+    )
+    chain = res.select_chain if select_only else res.qa_chain
+    raw = chain.invoke(
+        {"input_documents": docs[:CONTEXT_K], "question": zh_query}
+    ).get("output_text", "")
     blocks = [b.strip() for b in raw.strip().split('---') if b.strip()]
 
     results = []
+    pending = []  # 翻訳待ち：(results の位置, 行, place_id)
     for block in blocks:
         processed = _post_process(block)
 
@@ -166,14 +604,13 @@ def answer_ramen(query: str, metadata_filters: Optional[Dict[str, Any]] = None)
         matched_photo = ""
         matched_rating = None
         matched_reviews = None
-        for doc in docs:
-            title = doc.metadata.get("title", "")
-            if store_name in title:
-                matched_url     = doc.metadata.get("maps_url", "N/A")
-                matched_photo   = doc.metadata.get("photo_url", "")
-                matched_rating  = doc.metadata.get("rating", None)
-                matched_reviews = doc.metadata.get("reviews_count", None)
-                break
+        doc = _resolve_store(res, store_name, docs)
+        place_id = doc.metadata.get("place_id") if doc is not None else None
+        if doc is not None:
+            matched_url     = doc.metadata.get("maps_url", "N/A")
+            matched_photo   = doc.metadata.get("photo_url", "")
+            matched_rating  = doc.metadata.get("rating", None)
+            matched_reviews = doc.metadata.get("reviews_count", None)
 
         # 評価行を構築（★と☆で5段階／数値／件数）
         rating_line = None
@@ -210,6 +647,14 @@ def answer_ramen(query: str, metadata_filters: Optional[Dict[str, Any]] = None)
         # Link 行は最後に1本だけ
         lines.append(f"Link：{matched_url}")
 
+        # 店舗カードがあれば 地址 / 推薦 / 特色 / 營業時間 はカードの値（質問の言語のもの）を使う
+        card = card_fields(res.place_cards, place_id, card_lang)
+        if card:
+            head = [l for l in lines if l.startswith(("店名：", "評價："))]
+            lines = head + [f"{k}：{v}" for k, v in card.items()] + [f"Link：{matched_url}"]
+        elif select_only:
+            continue  # 店名しか返っていないのにカードが引けない（候補外の店名）
+
         final_text = "\n".join(lines)
 
     # # final_text = ... を作った後の部分を差し替え
@@ -241,21 +686,26 @@ def answer_ramen(query: str, metadata_filters: Optional[Dict[str, Any]] = None)
     #     final_text = "\n".join(translated_lines)
 
 
-        # 多言語対応（店名は翻訳しない）
-        if not src_lang.startswith("zh"):
-            name_line = next((l for l in lines if l.startswith("店名：")), None)
-            other_lines = [l for l in lines if not l.startswith("店名：")]
-            translated = _translate("\n".join(other_lines), src_lang)
-            final_text = "\n".join(filter(None, [name_line, translated]))
-
         results.append({
             "text": final_text.strip(),
-            "photo_url": matched_photo
+            "photo_url": matched_photo,
+            "place_id": place_id,
         })
+        if not card:
+            pending.append((len(results) - 1, lines, place_id))
 
         if len(results) >= 3:
             break
 
+    # 多言語対応：全店舗分をまとめて1回で訳す（店名・評價・Link は訳さない）
+    # （カードから作った店はすでに質問の言語なので訳さない）
+    if pending and not src_lang.startswith("zh") and src_lang in _TRANSLATE_LANGS:
+        texts = _translate_blocks([(lines, place_id) for _, lines, place_id in pending], src_lang)
+        for (i, _, _), text in zip(pending, texts):
+            results[i]["text"] = text.strip()
+
+    if ANSWER_CACHE_ENABLED and results:
+        _answer_cache.put(query_vector, cache_key, results)
     return results
 
 
@@ -576,6 +1026,22 @@ def answer_ramen(query: str, metadata_filters: Optional[Dict[str, Any]] = None)
 
 
 
+def embed_query(text: str) -> List[float]:
+    """検索と同じ埋め込み（キャッシュ付き）で text を埋め込む"""
+    return _get_resources().embedding.embed_query(text)
+
+def translation_cache_stats() -> dict:
+    """店舗項目の翻訳キャッシュのヒット/ミス数"""
+    return _translation_cache.stats()
+
+def embedding_cache_stats() -> dict:
+    """クエリ埋め込みキャッシュのヒット/ミス数"""
+    return _resources.embedding.stats() if _resources is not None else {}
+
+def answer_cache_stats() -> dict:
+    """回答キャッシュのヒット/ミス数"""
+    return _answer_cache.stats()
+
 # ───────────────────────────────────────
 # ヘルパー：翻訳
 # ───────────────────────────────────────
@@ -588,7 +1054,64 @@ def _translate(text: str, target_lang: str) -> str:
         prompt = f"请将以下简体中文翻译成英语：\n\n{text}"
     else:
         return text
-    return _llm.invoke(prompt).content.strip()
+    return _get_resources().llm.invoke(prompt).content.strip()
+
+_TRANSLATE_LANGS = {"ja": "日语", "en": "英语"}
+# 値を訳さない項目 / 店舗ごとに訳をキャッシュする項目
+_KEEP_FIELDS = ("店名", "評價", "Link")
+_CACHED_FIELDS = ("地址", "特色", "營業時間")
+
+def _translate_fields(items: Dict[str, str], target_lang: str) -> Dict[str, str]:
+    """{id: 中文} を1回の LLM 呼び出しでまとめて訳す（JSON で返させる）"""
+    if not items:
+        return {}
+    prompt = (
+        f"请将以下 JSON 中每个值从中文翻译成{_TRANSLATE_LANGS[target_lang]}。"
+        "键保持不变，只输出 JSON，不要加入其他文字：\n\n"
+        + json.dumps(items, ensure_ascii=False)
+    )
+    raw = _get_resources().llm.invoke(prompt).content.strip()
+    match = re.search(r"\{.*\}", raw, re.S)
+    try:
+        out = json.loads(match.group(0)) if match else {}
+    except ValueError:
+        out = {}
+    # 返ってこなかった項目だけ1件ずつ訳す（従来どおり）
+    return {k: str(out.get(k) or _translate(v, target_lang)) for k, v in items.items()}
+
+def _translate_blocks(blocks: List[tuple], target_lang: str) -> List[str]:
+    """[(行, place_id)] の各行の値を target_lang に訳して組み立て直す。
+    地址・特色・營業時間は (place_id, 項目, 言語) のキャッシュを先に見て、残りを1回で訳す"""
+    parsed = [[line.partition("：") for line in lines] for lines, _ in blocks]
+    cache_key = lambda b, key: (blocks[b][1], key, target_lang)  # noqa: E731
+    cacheable = {
+        (b, i): cache_key(b, key)
+        for b, kvs in enumerate(parsed) for i, (key, _, val) in enumerate(kvs)
+        if blocks[b][1] and key in _CACHED_FIELDS and val
+    }
+    cached = _translation_cache.get_many(cacheable.values())
+
+    todo = {
+        f"{b}.{i}": val
+        for b, kvs in enumerate(parsed) for i, (key, _, val) in enumerate(kvs)
+        if val and key not in _KEEP_FIELDS and cacheable.get((b, i)) not in cached
+    }
+    translated = _translate_fields(todo, target_lang)
+    _translation_cache.put_many({
+        cacheable[(b, i)]: translated[f"{b}.{i}"]
+        for (b, i) in cacheable if f"{b}.{i}" in translated
+    })
+
+    texts = []
+    for b, kvs in enumerate(parsed):
+        out = []
+        for i, (key, sep, val) in enumerate(kvs):
+            if (b, i) in cacheable and cacheable[(b, i)] in cached:
+                val = cached[cacheable[(b, i)]]
+            val = translated.get(f"{b}.{i}", val)
+            out.append(f"{key}{sep}{val}")
+        texts.append("\n".join(out))
+    return texts
 
 # ───────────────────────────────────────
 # ヘルパー：整形
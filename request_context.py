@@ -0,0 +1,100 @@
+# request_context.py
+#
+# 1メッセージ分の解析結果（言語・検索用の中国語・座標・埋め込み）を1回だけ作り、
+# line_bot → ramen_qa.answer_ramen へそのまま渡す。
+# これまでは言語判定が2回（detect_locale / langdetect）、LLM 呼び出しが2回（地名抽出 / 質問の翻訳）、
+# ジオコードが2回（geo_utils / ramen_qa）走っていたのを、それぞれ1回にする。
+# 質問中の条件（評価・件数・価格帯・捷運站・距離・営業中）も同じ LLM 呼び出しで抜き出し、
+# filter_engine の filter にして answer_ramen に渡す。
+
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import geo_utils
+import ramen_qa
+
+
+@dataclass
+class RequestContext:
+    text: str                                  # ユーザーの原文
+    locale: str                                # zh / ja / en、それ以外は langdetect の言語コード（回答の言語）
+    zh_query: str                              # 検索・生成に使う中国語の質問
+    place: Optional[str] = None                # 質問中の地名
+    coord: Optional[Tuple[float, float]] = None  # 地名の座標（距離順の並べ替えの中心）
+    query_vector: Optional[List[float]] = None   # zh_query の埋め込み（回答キャッシュの照合と検索で共用）
+    filters: Optional[Dict[str, Any]] = None     # answer_ramen の metadata_filters（filter_engine の書式）
+
+
+_HAN = re.compile(r"[\u4E00-\u9FFF]")
+
+
+def _fallback_locale(text: str, locale: str) -> str:
+    """detect_locale は zh / ja / en しか返さないので、漢字のない「zh」（韓国語・タイ語など）は langdetect で見直す"""
+    if locale != "zh" or _HAN.search(text):
+        return locale
+    try:
+        from langdetect import detect
+
+        lang = detect(text)
+    except Exception:
+        return locale
+    return "zh" if lang.startswith("zh") else lang
+
+
+def _num(val) -> Optional[float]:
+    try:
+        return float(val) if val is not None and val != "" else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _filters_from(conditions: Dict[str, Any], coord: Optional[Tuple[float, float]]) -> Optional[Dict[str, Any]]:
+    """LLM が抜き出した条件を filter_engine の filter にする（範囲外の値は捨てる）"""
+    spec: Dict[str, Any] = {}
+    rating = _num(conditions.get("min_rating"))
+    if rating is not None and 0 < rating <= 5:
+        spec["rating"] = {"gte": rating}
+    reviews = _num(conditions.get("min_reviews"))
+    if reviews is not None and reviews > 0:
+        spec["reviews_count"] = {"gte": int(reviews)}
+    price = _num(conditions.get("max_price_level"))
+    if price is not None and 1 <= price <= 4:
+        spec["price_level"] = {"lte": int(price)}
+    station = str(conditions.get("mrt_station") or "").strip()
+    if station:
+        spec["mrt_stations"] = [station]
+    if conditions.get("open_now") is True:
+        # 営業時間の分からない店まで落とすと残らないことが多いので、不明は残す
+        spec["open_at"] = {"at": "now", "include_unknown": True}
+    if coord:
+        # 座標は距離順の基準。距離の指定があったときだけ半径で絞る
+        location: Dict[str, Any] = {"lat": coord[0], "lng": coord[1]}
+        radius = _num(conditions.get("radius_m"))
+        if radius is not None and 100 <= radius <= 20000:
+            location["radius_m"] = radius
+        spec["location"] = location
+    return spec or None
+
+
+def build_context(text: str, locale: str, api_key: Optional[str]) -> RequestContext:
+    """地名抽出と翻訳は1回の LLM 呼び出し、ジオコードは地名があるときだけ1回、埋め込みも1回"""
+    locale = _fallback_locale(text, locale)
+    analysis = geo_utils.analyze_query(text, translate=(locale != "zh"))
+    coord = None
+    if analysis["place"] and api_key:
+        try:
+            lat, lng = geo_utils.geocode(analysis["place"], api_key)
+            coord = (lat, lng) if lat is not None and lng is not None else None
+        except Exception as e:
+            print(f"[ERROR] 座標変換失敗: {e}")
+    zh_query = text if locale == "zh" else analysis["zh_query"]
+    return RequestContext(
+        text=text,
+        locale=locale,
+        zh_query=zh_query,
+        place=analysis["place"],
+        coord=coord,
+        query_vector=ramen_qa.embed_query(zh_query),
+        filters=_filters_from(analysis.get("conditions") or {}, coord),
+    )
@@ -0,0 +1,206 @@
+# serve.py
+#
+# line_bot を複数ワーカーで動かす起動スクリプト（fork を使うので Linux / macOS 用）。
+# 親プロセスでインデックスと各テーブルを1回だけ読み込み、gc.freeze() してから fork するので、
+# ワーカーはそれを copy-on-write で共有する（ワーカー数を増やしても RSS がほとんど増えない）。
+# FAISS_MMAP=1 ならインデックスファイル自体も mmap で開き、OS のページキャッシュを共有する。
+#
+#   python serve.py          SERVE_HOST / SERVE_PORT / SERVE_WORKERS（既定は CPU 数）
+#   kill -HUP <親の pid>     新しい版のインデックスを親で読み込み、ワーカーを順に入れ替える
+#   kill -TERM <親の pid>    全ワーカーを止めて終了
+# 止めるワーカーには SIGTERM を送り、キューに残ったイベントを処理し終えるまで
+# SERVE_GRACEFUL_TIMEOUT_SEC 待つ。それでも終わらなければ SIGKILL。
+# インデックスの新しい版（CURRENT）の監視も親で行う（INDEX_WATCH_INTERVAL_SEC）。
+# 想定外に落ちたワーカーは枠ごとに SERVE_RESPAWN_BACKOFF_SEC × 1, 2, 4…秒（上限 SERVE_RESPAWN_BACKOFF_MAX_SEC）
+# 待ってから立て直す。同じ枠が SERVE_CRASH_WINDOW_SEC 秒内に SERVE_CRASH_MAX 回落ちたら、
+# 全ワーカーを止めて終了コード 1 で終わる（起動直後に必ず落ちる設定ミスで fork し続けない）。
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import logging
+
+import uvicorn
+
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", os.getenv("PORT", "8000")))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", "0")) or (os.cpu_count() or 1)
+SERVE_BACKLOG = int(os.getenv("SERVE_BACKLOG", "2048"))
+INDEX_WATCH_INTERVAL_SEC = float(os.getenv("INDEX_WATCH_INTERVAL_SEC", "60"))
+# line_bot の WORKER_DRAIN_TIMEOUT_SEC（既定 30 秒）より長くしておく
+SERVE_GRACEFUL_TIMEOUT_SEC = float(os.getenv("SERVE_GRACEFUL_TIMEOUT_SEC", "60"))
+SERVE_RESPAWN_BACKOFF_SEC = float(os.getenv("SERVE_RESPAWN_BACKOFF_SEC", "1"))
+SERVE_RESPAWN_BACKOFF_MAX_SEC = float(os.getenv("SERVE_RESPAWN_BACKOFF_MAX_SEC", "30"))
+SERVE_CRASH_MAX = int(os.getenv("SERVE_CRASH_MAX", "5"))
+SERVE_CRASH_WINDOW_SEC = float(os.getenv("SERVE_CRASH_WINDOW_SEC", "300"))
+# ワーカーは自分では監視・再読み込みしない（各自で読み直すと共有が崩れるため、親がまとめて行う）
+os.environ["INDEX_WATCH_INTERVAL_SEC"] = "0"
+
+logger = logging.getLogger("serve")
+if not logger.handlers:
+    h = logging.StreamHandler(sys.stdout)
+    h.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+    logger.addHandler(h)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+
+def _bind() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((SERVE_HOST, SERVE_PORT))
+    sock.listen(SERVE_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _spawn(app, sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    # ---- 子プロセス ----
+    for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    code = 0
+    try:
+        config = uvicorn.Config(app, lifespan="on", log_level=os.getenv("LOG_LEVEL", "info").lower())
+        uvicorn.Server(config).run(sockets=[sock])
+    except Exception:
+        logger.exception("worker crashed")
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def _retire(pids, retiring: dict) -> None:
+    """SIGTERM を送り、猶予の期限を記録する（期限を過ぎたら _escalate が SIGKILL）"""
+    deadline = time.monotonic() + SERVE_GRACEFUL_TIMEOUT_SEC
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            continue
+        retiring[pid] = deadline
+
+
+def _escalate(retiring: dict) -> None:
+    now = time.monotonic()
+    for pid, deadline in list(retiring.items()):
+        if deadline is not None and now >= deadline:
+            logger.warning(f"worker {pid} did not exit within {SERVE_GRACEFUL_TIMEOUT_SEC:.0f}s; killing")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            retiring[pid] = None  # 回収は waitpid に任せる
+
+
+def _load_shared() -> None:
+    """fork 前に親で読み込んでおくもの。スレッドはまだ作らない（fork と相性が悪い）"""
+    import geo_utils
+    import ramen_qa
+
+    t0 = time.perf_counter()
+    ramen_qa.warmup()
+    geo_utils.warmup()
+    # 読み込んだオブジェクトを GC の対象外にする（GC が触って共有ページがコピーされるのを防ぐ）
+    gc.collect()
+    gc.freeze()
+    logger.info(f"🔥 loaded index {ramen_qa.index_version() or '(legacy)'} in {time.perf_counter() - t0:.1f}s")
+
+
+def main() -> None:
+    import ramen_qa
+    from index_versions import resolve_index_path
+    from line_bot import app
+
+    _load_shared()
+    sock = _bind()
+    workers = {_spawn(app, sock): slot for slot in range(SERVE_WORKERS)}  # pid → 枠
+    retiring: dict = {}  # pid → SIGKILL する期限
+    crashes: dict = {}  # 枠 → SERVE_CRASH_WINDOW_SEC 内に落ちた時刻
+    respawn_at: dict = {}  # 枠 → 立て直す時刻
+    logger.info(f"🚀 {len(workers)} workers on {SERVE_HOST}:{SERVE_PORT} (pids={sorted(workers)})")
+
+    state = {"stop": False, "reload": False, "failed": False}
+    signal.signal(signal.SIGTERM, lambda *_: state.update(stop=True))
+    signal.signal(signal.SIGINT, lambda *_: state.update(stop=True))
+    signal.signal(signal.SIGHUP, lambda *_: state.update(reload=True))
+
+    next_watch = time.monotonic() + INDEX_WATCH_INTERVAL_SEC
+    while not state["stop"]:
+        if INDEX_WATCH_INTERVAL_SEC > 0 and time.monotonic() >= next_watch:
+            next_watch = time.monotonic() + INDEX_WATCH_INTERVAL_SEC
+            if resolve_index_path()[1] != ramen_qa.index_version():
+                state["reload"] = True
+
+        if state["reload"]:
+            state["reload"] = False
+            try:
+                gc.unfreeze()
+                result = ramen_qa.reload_index()
+                gc.collect()
+                gc.freeze()
+                if result.get("reloaded"):
+                    # 新しいワーカーを先に立ててから古いワーカーを止める（同じソケットなので取りこぼさない）
+                    old = workers
+                    workers = {_spawn(app, sock): slot for slot in range(SERVE_WORKERS)}
+                    respawn_at.clear()
+                    _retire(old, retiring)
+                    logger.info(f"🔄 index {result.get('version')} loaded, workers replaced (pids={sorted(workers)})")
+            except Exception as e:
+                gc.freeze()
+                logger.exception(f"index reload failed (keeping current workers): {e}")
+
+        # 終了したワーカーの回収。想定外に落ちたものは間をあけて立て直す
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            if pid in retiring:
+                retiring.pop(pid)
+            elif pid in workers:
+                slot = workers.pop(pid)
+                now = time.monotonic()
+                recent = [t for t in crashes.get(slot, []) if now - t < SERVE_CRASH_WINDOW_SEC] + [now]
+                crashes[slot] = recent
+                if len(recent) >= SERVE_CRASH_MAX:
+                    logger.error(f"worker {pid} exited (status={status}); slot {slot} crashed {len(recent)} times "
+                                 f"within {SERVE_CRASH_WINDOW_SEC:.0f}s, giving up")
+                    state.update(stop=True, failed=True)
+                    break
+                delay = min(SERVE_RESPAWN_BACKOFF_SEC * 2 ** (len(recent) - 1), SERVE_RESPAWN_BACKOFF_MAX_SEC)
+                respawn_at[slot] = now + delay
+                logger.warning(f"worker {pid} exited (status={status}); respawning in {delay:.1f}s")
+        if not state["stop"]:
+            for slot, at in list(respawn_at.items()):
+                if time.monotonic() >= at:
+                    del respawn_at[slot]
+                    workers[_spawn(app, sock)] = slot
+        _escalate(retiring)
+        time.sleep(0.5)
+
+    logger.info("🛑 stopping workers")
+    _retire(workers, retiring)
+    while retiring:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            retiring.pop(pid, None)
+            continue
+        _escalate(retiring)
+        time.sleep(0.2)
+    sock.close()
+    if state["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+# shard_index.py
+#
+# 地区（metadata の area）または geohash セルごとに分けた FAISS インデックス。
+#   faiss_index/shards/shards.json        シャードの一覧（中心・半径・件数・ファイル名）
+#   faiss_index/shards/<名前>.faiss       シャードのインデックス（行は局所番号）
+#   faiss_index/shards/<名前>.rows.npy    局所番号 → 全体の行番号（docstore と共通）
+# 検索側は ShardedIndex を vectorstore.index の代わりに置く。行番号は全体のままなので、
+# docstore・filter マスク・BM25・geo インデックスはそのまま使える。
+# 座標があれば範囲内のシャードだけを、スレッドで並列に検索して top-k をマージする。
+
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+import faiss
+
+from faiss_tuning import build_index, search_with_mask
+from geo_index import haversine_m
+
+SHARDS_DIR = "shards"
+MANIFEST_FILE = "shards.json"
+UNLOCATED = "_unlocated"
+# これより小さいシャードは近似インデックスにせず flat のまま（学習データも足りない）
+SHARD_FLAT_MAX = int(os.getenv("SHARD_FLAT_MAX", "2000"))
+SHARD_SEARCH_THREADS = int(os.getenv("SHARD_SEARCH_THREADS", "4"))
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat: float, lng: float, precision: int = 5) -> str:
+    """標準の geohash（5 桁でおよそ 4.9km 四方）"""
+    lat_rng, lng_rng = [-90.0, 90.0], [-180.0, 180.0]
+    bits, even, out, ch = 0, True, [], 0
+    while len(out) < precision:
+        rng, val = (lng_rng, lng) if even else (lat_rng, lat)
+        mid = (rng[0] + rng[1]) / 2
+        ch <<= 1
+        if val >= mid:
+            ch |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return "".join(out)
+
+
+_DISTRICT_ZH = re.compile(r"(?:市|縣|^)\s*([^\s\d市縣區]{1,3}區)")
+_DISTRICT_EN = re.compile(r"([A-Za-z]+)\s+Dist(?:rict|\.)", re.IGNORECASE)
+
+
+def district_of(text: str) -> Optional[str]:
+    """住所や地名から行政区（「大安區」「Da'an District」→「大安區」/「Daan」）を取り出す"""
+    if not text:
+        return None
+    m = _DISTRICT_ZH.search(text)
+    if m:
+        return m.group(1)
+    m = _DISTRICT_EN.search(text.replace("'", ""))
+    return m.group(1).capitalize() if m else None
+
+
+def shard_keys(metadatas: Sequence[dict], by: str = "geohash", precision: int = 5) -> List[str]:
+    """行ごとのシャード名。by=area なら metadata の area（なければ geohash）"""
+    keys = []
+    for md in metadatas:
+        md = md or {}
+        if by == "area" and md.get("area"):
+            keys.append(str(md["area"]))
+            continue
+        loc = md.get("location") or {}
+        if loc.get("lat") is None or loc.get("lng") is None:
+            keys.append(UNLOCATED)
+        else:
+            keys.append(geohash(float(loc["lat"]), float(loc["lng"]), precision))
+    return keys
+
+
+def _file_stem(i: int, key: str) -> str:
+    return f"{i:03d}_" + re.sub(r"[^0-9A-Za-z_\-]", "_", key)
+
+
+def write_shards(index_dir: str, flat_index, metadatas: Sequence[dict], keys: Sequence[str],
+                 index_type: str = "flat", **params) -> dict:
+    """全体の flat インデックスからシャードを切り出して保存する"""
+    out_dir = os.path.join(index_dir, SHARDS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in os.listdir(out_dir):
+        os.remove(os.path.join(out_dir, name))
+
+    keys = np.asarray(keys, dtype=object)
+    lats = np.array([((md or {}).get("location") or {}).get("lat", np.nan) or np.nan for md in metadatas], dtype=float)
+    lngs = np.array([((md or {}).get("location") or {}).get("lng", np.nan) or np.nan for md in metadatas], dtype=float)
+
+    shards = []
+    for i, key in enumerate(sorted(set(keys))):
+        rows = np.flatnonzero(keys == key).astype(np.int64)
+        vecs = flat_index.reconstruct_batch(rows)
+        kind = index_type if len(rows) > SHARD_FLAT_MAX else "flat"
+        index = build_index(vecs, kind, flat_index.metric_type, **params)
+
+        stem = _file_stem(i, key)
+        faiss.write_index(index, os.path.join(out_dir, f"{stem}.faiss"))
+        np.save(os.path.join(out_dir, f"{stem}.rows.npy"), rows)
+
+        located = ~np.isnan(lats[rows])
+        center, radius = None, None
+        if located.any():
+            center = [float(np.mean(lats[rows][located])), float(np.mean(lngs[rows][located]))]
+            radius = float(haversine_m(center[0], center[1], lats[rows][located], lngs[rows][located]).max())
+        shards.append({"name": key, "file": stem, "count": int(len(rows)), "index_type": kind,
+                       "center": center, "radius_m": radius, "located_all": bool(located.all())})
+
+    manifest = {"ntotal": int(flat_index.ntotal), "dim": int(flat_index.d),
+                "metric_type": int(flat_index.metric_type), "shards": shards}
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def exists(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, SHARDS_DIR, MANIFEST_FILE))
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS, thread_name_prefix="shard-search")
+    return _executor
+
+
+class ShardedIndex:
+    """複数シャードを1つの FAISS インデックスのように見せる（search / reconstruct_batch）"""
+
+    def __init__(self, index_dir: str, io_flags: int = 0):
+        path = os.path.join(index_dir, SHARDS_DIR)
+        with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.ntotal = int(self.manifest["ntotal"])
+        self.d = int(self.manifest["dim"])
+        self.metric_type = int(self.manifest["metric_type"])
+        self.meta = self.manifest["shards"]
+        self.shards = [faiss.read_index(os.path.join(path, f"{m['file']}.faiss"), io_flags) for m in self.meta]
+        self.rows = [np.load(os.path.join(path, f"{m['file']}.rows.npy")) for m in self.meta]
+
+        # 全体の行番号 → (シャード, 局所番号)
+        self._shard_of = np.full(self.ntotal, -1, dtype=np.int32)
+        self._local_of = np.full(self.ntotal, -1, dtype=np.int64)
+        for s, rows in enumerate(self.rows):
+            self._shard_of[rows] = s
+            self._local_of[rows] = np.arange(len(rows))
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def select(self, lat: float, lng: float, radius_m: float) -> List[int]:
+        """(lat, lng) から radius_m 以内に店がありうるシャード。座標のない店を含むシャードは常に対象"""
+        out = []
+        for s, m in enumerate(self.meta):
+            if m["center"] is None or not m["located_all"]:
+                out.append(s)
+                continue
+            d = float(haversine_m(lat, lng, np.asarray([m["center"][0]]), np.asarray([m["center"][1]]))[0])
+            if d - m["radius_m"] <= radius_m:
+                out.append(s)
+        return out
+
+    def _search_one(self, s: int, q: np.ndarray, k: int, mask: Optional[np.ndarray]):
+        """1シャードの (nq, k') の結果。行番号は全体の行番号、見つからない枠は -1"""
+        index, rows = self.shards[s], self.rows[s]
+        if mask is not None:
+            local = mask[rows]
+            if not local.any():
+                return np.empty((len(q), 0), dtype=np.float32), np.empty((len(q), 0), dtype=np.int64)
+            D, I = search_with_mask(index, q, min(k, int(local.sum())), local)
+        else:
+            D, I = index.search(q, min(k, index.ntotal))
+        return D, np.where(I >= 0, rows[np.maximum(I, 0)], -1)
+
+    def search(self, q: np.ndarray, k: int, mask: Optional[np.ndarray] = None,
+               shards: Optional[Sequence[int]] = None):
+        """対象シャードを並列に検索し、クエリごとに全体の行番号で上位 k 件にまとめる（形は faiss の search と同じ (nq, k)）"""
+        q = np.ascontiguousarray(q, dtype=np.float32).reshape(-1, self.d)
+        targets = list(range(len(self.shards))) if shards is None else list(shards)
+        if len(targets) == 1:
+            parts = [self._search_one(targets[0], q, k, mask)]
+        else:
+            parts = list(_get_executor().map(lambda s: self._search_one(s, q, k, mask), targets))
+        D_out = np.full((len(q), k), np.nan, dtype=np.float32)
+        I_out = np.full((len(q), k), -1, dtype=np.int64)
+        if not parts:
+            return D_out, I_out
+        D = np.concatenate([p[0] for p in parts], axis=1)
+        I = np.concatenate([p[1] for p in parts], axis=1)
+        # 内積は大きいほど近い、L2 は小さいほど近い。見つからない枠は最後へ
+        key = np.where(I >= 0, -D if self.metric_type == faiss.METRIC_INNER_PRODUCT else D, np.inf)
+        order = np.argsort(key, axis=1, kind="stable")[:, :k]
+        D_top = np.take_along_axis(D, order, axis=1)
+        I_top = np.take_along_axis(I, order, axis=1)
+        found = I_top >= 0
+        D_out[:, :order.shape[1]] = np.where(found, D_top, np.nan)
+        I_out[:, :order.shape[1]] = I_top
+        return D_out, I_out
+
+    def reconstruct_batch(self, rows) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows), self.d), dtype=np.float32)
+        shard_ids = self._shard_of[rows]
+        for s in np.unique(shard_ids):
+            sel = np.flatnonzero(shard_ids == s)
+            out[sel] = self.shards[s].reconstruct_batch(self._local_of[rows[sel]])
+        return out
+
+    def reconstruct(self, row: int) -> np.ndarray:
+        return self.reconstruct_batch([row])[0]
@@ -0,0 +1,38 @@
+import numpy as np
+
+from opening_hours import SLOT_MIN, SLOTS_PER_DAY, WEEK_SLOTS, parse_weekday_text
+
+
+def _open_slots(line):
+    week = parse_weekday_text([line])
+    assert week is not None
+    return set(np.flatnonzero(week).tolist())
+
+
+def _slots(start_min, end_min, day=0):
+    base = day * SLOTS_PER_DAY
+    return {(base + s) % WEEK_SLOTS for s in range(start_min // SLOT_MIN, end_min // SLOT_MIN)}
+
+
+def test_start_without_ampm_takes_end_marker():
+    # 5:00 – 10:00 PM は 17:00–22:00（05:00 からではない）
+    assert _open_slots("Monday: 5:00 – 10:00 PM") == _slots(17 * 60, 22 * 60)
+
+
+def test_start_without_ampm_stays_morning_when_end_is_earlier():
+    assert _open_slots("Monday: 11:00 – 2:00 PM") == _slots(11 * 60, 14 * 60)
+
+
+def test_zh_prefixes():
+    assert _open_slots("星期一: 下午5:00–晚上10:00") == _slots(17 * 60, 22 * 60)
+
+
+def test_overnight_range():
+    # 日付をまたいで火曜の 02:00 まで
+    assert _open_slots("Monday: 11:00 AM – 2:00 AM") == _slots(11 * 60, 26 * 60)
+
+
+def test_sunday_overnight_wraps_to_monday():
+    slots = _open_slots("Sunday: 6:00 PM – 1:00 AM")
+    assert slots == _slots(18 * 60, 25 * 60, day=6)
+    assert 0 in slots
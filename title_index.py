@@ -0,0 +1,141 @@
+# title_index.py
+#
+# LLM が書いた店名 → 店舗（FAISS の行番号）を引くための店名インデックス。
+# 全角半角・繁体字/簡体字・記号・空白の違いをならし、「中山店」「(本店)」のような
+# 支店名は分けて持つ。完全一致は dict、ゆれは 2-gram 転置インデックス + Dice 係数で引く。
+
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from opencc import OpenCC
+    try:
+        _t2s = OpenCC("t2s").convert
+    except Exception:
+        _t2s = OpenCC("t2s.json").convert
+except Exception:  # opencc がなければ店名によく出る字だけの簡易表
+    _T2S_TABLE = str.maketrans(
+        "麵麺館鳥雞鶏豬樂楽龍竜鮮魚燒焼醬園東風華廳飯點號樓門灣臺頭蘭鷹條蝦湯麥黃長來爾無個為與萬國學氣義廣壽濃豐葉藝實喬鍋燉滷魯雲寶貝島亞將軍勝蔥燈屆際機場體廚廠廟鄉錦記",
+        "面面馆鸟鸡鸡猪乐乐龙龙鲜鱼烧烧酱园东风华厅饭点号楼门湾台头兰鹰条虾汤麦黄长来尔无个为与万国学气义广寿浓丰叶艺实乔锅炖卤鲁云宝贝岛亚将军胜葱灯届际机场体厨厂庙乡锦记",
+    )
+    _t2s = lambda s: s.translate(_T2S_TABLE)  # noqa: E731
+
+# 末尾の支店名（「鷹流拉麵 中山店」「Ramen Nagi - 信義店」）と括弧書き（「一蘭（台北本店）」）
+_BRANCH_TAIL = re.compile(r"[\s\-–—|/・]+([^\s\-–—|/・]{1,12}(?:本店|分店|店|門市|门市|支店|branch))$", re.IGNORECASE)
+_BRACKETS = re.compile(r"[(（\[【「](.*?)[)）\]】」]")
+
+DICE_MIN = 0.5
+# 包含による加点は、短い方がこの文字数以上で、長い方に占める割合がこれ以上のときだけ
+# （「拉麵」のような一般語が多くの店名に含まれて高得点になるのを防ぐ）
+CONTAIN_MIN_CHARS = 3
+CONTAIN_MIN_RATIO = 0.4
+
+
+def _strip(s: str) -> str:
+    """空白・記号を落とす"""
+    return "".join(ch for ch in s if unicodedata.category(ch)[0] not in "PSZC")
+
+
+def normalize_title(name: str) -> Tuple[str, str]:
+    """(店名全体, 支店名を除いた本体) を正規化して返す"""
+    s = _t2s(unicodedata.normalize("NFKC", name or "").lower().strip())
+    base = _BRACKETS.sub(" ", s).strip()
+    base = _BRANCH_TAIL.sub("", base)
+    return _strip(s), _strip(base) or _strip(s)
+
+
+def _bigrams(s: str) -> List[str]:
+    if len(s) < 2:
+        return [s] if s else []
+    return sorted({s[i:i + 2] for i in range(len(s) - 1)})
+
+
+class TitleIndex:
+    def __init__(self, titles: Iterable[str], place_codes: np.ndarray):
+        # 店舗ごとに代表の1行（最初に出てきたチャンク）だけを持つ
+        self._row: List[int] = []
+        self._full: List[str] = []
+        self._base: List[str] = []
+        self._exact_full: Dict[str, List[int]] = {}
+        self._exact_base: Dict[str, List[int]] = {}
+        postings: Dict[str, List[int]] = {}
+        seen = set()
+        for row, (title, code) in enumerate(zip(titles, place_codes)):
+            if code in seen or not title:
+                continue
+            seen.add(code)
+            pid = len(self._row)
+            full, base = normalize_title(title)
+            self._row.append(row)
+            self._full.append(full)
+            self._base.append(base)
+            self._exact_full.setdefault(full, []).append(pid)
+            self._exact_base.setdefault(base, []).append(pid)
+            for g in _bigrams(base):
+                postings.setdefault(g, []).append(pid)
+
+        self._code = np.asarray([place_codes[r] for r in self._row], dtype=np.int64)
+        self._postings = {g: np.asarray(p, dtype=np.int64) for g, p in postings.items()}
+        self._n_grams = np.asarray([len(_bigrams(b)) for b in self._base], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self._row)
+
+    @classmethod
+    def from_metadatas(cls, metadatas: Iterable[dict], place_codes: np.ndarray) -> "TitleIndex":
+        return cls(((md or {}).get("title") or "" for md in metadatas), place_codes)
+
+    def _pick(self, pids: List[int], full: str) -> int:
+        """同名の店が複数あれば、支店名まで含めて近いものを選ぶ"""
+        if len(pids) == 1:
+            return pids[0]
+        q = set(_bigrams(full))
+        return max(pids, key=lambda p: len(q & set(_bigrams(self._full[p]))))
+
+    def resolve(self, name: str, among: Optional[Iterable[int]] = None) -> Optional[int]:
+        """店名に一番近い店舗の行番号。among（place_code）があればその中だけから探す"""
+        full, base = normalize_title(name)
+        if not base:
+            return None
+        allowed = None if among is None else np.isin(self._code, list(among))
+
+        def ok(pids):
+            return [p for p in pids if allowed is None or allowed[p]]
+
+        for table, key in ((self._exact_full, full), (self._exact_base, base)):
+            pids = ok(table.get(key, []))
+            if pids:
+                return self._row[self._pick(pids, full)]
+
+        # 2-gram の共通数から Dice 係数（2|A∩B| / (|A|+|B|)）
+        grams = [g for g in _bigrams(base) if g in self._postings]
+        if not grams:
+            return None
+        hits = np.bincount(np.concatenate([self._postings[g] for g in grams]), minlength=len(self._row))
+        cand = np.flatnonzero(hits)
+        if allowed is not None:
+            cand = cand[allowed[cand]]
+        if not len(cand):
+            return None
+        dice = 2 * hits[cand] / (len(_bigrams(base)) + self._n_grams[cand])
+        # 片方がもう片方を含む（「麵屋一燈」と「麵屋一燈 台北店」）なら一致とみなしやすくする。
+        # 加点は長さの比に応じて 0.6〜1.0（短い一般語がたまたま含まれるだけなら加点しない）
+        contains = np.fromiter(
+            (base in self._base[p] or self._base[p] in base for p in cand), dtype=bool, count=len(cand)
+        )
+        lens = np.fromiter((len(self._base[p]) for p in cand), dtype=np.float64, count=len(cand))
+        short = np.minimum(lens, len(base))
+        ratio = short / np.maximum(np.maximum(lens, len(base)), 1)
+        boost = contains & (short >= CONTAIN_MIN_CHARS) & (ratio >= CONTAIN_MIN_RATIO)
+        score = np.where(boost, np.maximum(dice, 0.6 + 0.4 * ratio), dice)
+        best = int(np.argmax(score))
+        if score[best] < DICE_MIN:
+            return None
+        # 同点で別の店が並ぶ（一般語だけの店名など）なら決めつけない
+        tied = cand[score >= score[best] - 1e-9]
+        if len(np.unique(self._code[tied])) > 1:
+            return None
+        return self._row[int(cand[best])]
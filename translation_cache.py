@@ -0,0 +1,75 @@
+# translation_cache.py
+#
+# 店舗ごとの固定的な項目（地址 / 特色 / 營業時間）の翻訳を SQLite に保存しておく。
+# キーは (place_id, 項目, 言語)。同じ店が再び出てきたら翻訳トークンはかからない。
+# 接続は最初に使うときに開き、fork 後の子プロセスでは開き直す（serve.py の prefork 用）。
+
+import os
+import time
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+Key = Tuple[str, str, str]
+
+
+class TranslationCache:
+    def __init__(self, path: Optional[str] = "translation_cache.sqlite3", ttl_sec: float = 30 * 86400):
+        self._path = path
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self):
+        """呼び出し側で self._lock を取ってから呼ぶ"""
+        import sqlite3
+
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS place_translations ("
+                " place_id TEXT NOT NULL, field TEXT NOT NULL, lang TEXT NOT NULL,"
+                " text TEXT NOT NULL, created_at REAL NOT NULL,"
+                " PRIMARY KEY (place_id, field, lang))"
+            )
+            self._db_pid = os.getpid()
+        return self._db
+
+    def get_many(self, keys: Iterable[Key]) -> Dict[Key, str]:
+        keys = list(dict.fromkeys(keys))
+        if not self._path or not keys:
+            return {}
+        oldest = time.time() - self.ttl_sec
+        out: Dict[Key, str] = {}
+        with self._lock:
+            db = self._conn()
+            for key in keys:
+                row = db.execute(
+                    "SELECT text FROM place_translations"
+                    " WHERE place_id = ? AND field = ? AND lang = ? AND created_at >= ?",
+                    (*key, oldest),
+                ).fetchone()
+                if row:
+                    out[key] = row[0]
+            self.hits += len(out)
+            self.misses += len(keys) - len(out)
+        return out
+
+    def put_many(self, items: Dict[Key, str]) -> None:
+        if not self._path or not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn().executemany(
+                "INSERT OR REPLACE INTO place_translations (place_id, field, lang, text, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(*key, text, now) for key, text in items.items()],
+            )
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}